@@ -0,0 +1,159 @@
+import time
+import threading
+from collections import OrderedDict
+
+from chirplib.profiling import profile_call
+
+# Largest share of the remaining budget one call in each stage may take, so a
+# single slow subreddit or album can't starve everything after it
+STAGE_SHARES = {
+    'reddit': 0.5,
+    'imgur': 0.25,
+    'format': 0.25,
+    'media': 0.5,
+    'twitter': 1.0,
+}
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class RunBudget(object):
+    """ Wall clock budget for one run, shared out between its stages
+
+        With no deadline nothing is ever cut short, but time per stage is still
+        tracked for the report
+    """
+    def __init__(self, deadline=None, clock=time.monotonic):
+        self.deadline = deadline or None
+        self.clock = clock
+        self.restart()
+
+    def restart(self):
+        '''
+        Starts a fresh budget, e.g. for the next iteration of a looping worker
+        '''
+        self.started = self.clock()
+        # stage -> [seconds, calls, abandoned]
+        self.stages = OrderedDict()
+
+    def elapsed(self):
+        return self.clock() - self.started
+
+    def remaining(self):
+        if self.deadline is None:
+            return float('inf')
+        return self.deadline - self.elapsed()
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, stage):
+        '''
+        Returns the seconds one call in stage may take, or None if unbounded.
+        Raises BudgetExceeded if the budget is already spent
+        '''
+        if self.deadline is None:
+            return None
+
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise BudgetExceeded("Run budget of {0}s spent before {1}".format(self.deadline, stage))
+
+        return remaining * STAGE_SHARES.get(stage, 1.0)
+
+    def cap(self, timeout):
+        '''
+        Caps a (connect, read) or single timeout to what's left of the budget
+        '''
+        remaining = self.remaining()
+        if remaining == float('inf'):
+            return timeout
+
+        remaining = max(remaining, 0.001)
+        if isinstance(timeout, tuple):
+            return tuple(min(t, remaining) if t else remaining for t in timeout)
+        return min(timeout, remaining) if timeout else remaining
+
+    def run(self, stage, func, *args, **kwargs):
+        '''
+        Calls func within stage's slice of the remaining budget. A call that
+        overruns is abandoned on its (daemon) thread and BudgetExceeded raised
+        '''
+        timeout = self.timeout(stage)
+        begin = self.clock()
+
+        if timeout is None:
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._record(stage, self.clock() - begin)
+
+        result = dict()
+
+        def target():
+            try:
+                result['value'] = profile_call(func, *args, **kwargs)
+            except BaseException as exc:  # pylint: disable=W0703
+                result['error'] = exc
+
+        thread = threading.Thread(target=target, name='chirp-{0}'.format(stage))
+        thread.daemon = True
+        thread.start()
+        thread.join(timeout)
+
+        abandoned = thread.is_alive()
+        self._record(stage, self.clock() - begin, abandoned)
+
+        if abandoned:
+            exc_str = "{0} still running after {1:.1f}s, abandoned"
+            raise BudgetExceeded(exc_str.format(stage, timeout))
+        elif 'error' in result:
+            raise result['error']
+
+        return result['value']
+
+    def track(self, stage):
+        '''
+        Context manager timing a block against stage, without a timeout
+        '''
+        return _Tracked(self, stage)
+
+    def report(self):
+        """ Where the time went, for the log
+        """
+        lines = list()
+        for stage, (seconds, calls, abandoned) in self.stages.items():
+            line = "{0}: {1:.2f}s over {2} calls".format(stage, seconds, calls)
+            if abandoned:
+                line += " ({0} abandoned)".format(abandoned)
+            lines.append(line)
+
+        if self.deadline is None:
+            lines.append("{0:.2f}s elapsed, no deadline".format(self.elapsed()))
+        else:
+            lines.append("{0:.2f}s of {1}s budget used".format(self.elapsed(), self.deadline))
+
+        return "\n\t".join(lines)
+
+    def _record(self, stage, seconds, abandoned=False):
+        spent = self.stages.setdefault(stage, [0.0, 0, 0])
+        spent[0] += seconds
+        spent[1] += 1
+        spent[2] += int(abandoned)
+
+
+class _Tracked(object):
+    def __init__(self, budget, stage):
+        self.budget = budget
+        self.stage = stage
+        self.begin = None
+
+    def __enter__(self):
+        self.begin = self.budget.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.budget._record(self.stage, self.budget.clock() - self.begin)  # pylint: disable=W0212
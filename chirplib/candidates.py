@@ -0,0 +1,110 @@
+import json
+import sqlite3
+import time
+
+from chirplib import memes
+
+DEFAULT_TTL = 24 * 60 * 60
+
+
+class CandidateQueue(object):
+    """ Durable queue of memes that have already been classified, checked
+        against the collection and digested, waiting to be posted
+    """
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+
+        # isolation_level=None leaves transaction control to us, so pop()
+        # can take the write lock up front with BEGIN IMMEDIATE
+        self.con = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("""CREATE TABLE IF NOT EXISTS candidates
+                            (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                             links TEXT NOT NULL UNIQUE,
+                             sources TEXT NOT NULL,
+                             kind TEXT NOT NULL,
+                             state TEXT NOT NULL,
+                             queued REAL NOT NULL,
+                             expires REAL NOT NULL)
+                         """)
+        self.con.execute("CREATE INDEX IF NOT EXISTS candidates_expires "
+                         "ON candidates (expires)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        query = "SELECT COUNT(*) FROM candidates WHERE expires > ?"
+        return self.con.execute(query, (time.time(), )).fetchone()[0]
+
+    def __contains__(self, meme):
+        query = "SELECT 1 FROM candidates WHERE links = ? AND expires > ?"
+        return self.con.execute(query, (meme.link, time.time())).fetchone() is not None
+
+    def push(self, meme, ttl=None):
+        '''
+        Adds a meme to the queue. Returns False if the meme was already queued
+        '''
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+
+        query = """INSERT OR IGNORE INTO candidates
+                   (links, sources, kind, state, queued, expires)
+                   VALUES
+                   (?, ?, ?, ?, ?, ?)
+                """
+        cur = self.con.execute(query, (meme.link, meme.source, type(meme).__name__,
+                                       json.dumps(vars(meme)), now, now + ttl))
+
+        return cur.rowcount == 1
+
+    def pop(self):
+        '''
+        Removes and returns a random unexpired meme, or None if the queue is empty
+        '''
+        self.con.execute("BEGIN IMMEDIATE")
+        try:
+            self.purge_expired()
+            row = self.con.execute("""SELECT id, kind, state FROM candidates
+                                      ORDER BY RANDOM() LIMIT 1
+                                   """).fetchone()
+            if row is not None:
+                self.con.execute("DELETE FROM candidates WHERE id = ?", (row[0], ))
+        except Exception:
+            self.con.execute("ROLLBACK")
+            raise
+        else:
+            self.con.execute("COMMIT")
+
+        if row is None:
+            return None
+
+        return self._load_meme(row[1], row[2])
+
+    def close(self):
+        self.con.close()
+
+    def purge_expired(self):
+        '''
+        Drops every candidate whose expiry has passed
+        '''
+        cur = self.con.execute("DELETE FROM candidates WHERE expires <= ?", (time.time(), ))
+        return cur.rowcount
+
+    @staticmethod
+    def _load_meme(kind, state):
+        """ Rebuild a meme object without re-running its constructor, so digested
+            state (e.g. ImgurMeme.first_image_link) survives the round trip
+        """
+        meme_cls = getattr(memes, kind)
+        if not (isinstance(meme_cls, type) and issubclass(meme_cls, memes.Meme)):
+            raise TypeError("Unknown meme type in candidate queue: {0}".format(kind))
+
+        meme = meme_cls.__new__(meme_cls)
+        meme.__dict__.update(json.loads(state))
+
+        return meme
@@ -0,0 +1,350 @@
+import gzip
+import json
+import time
+import base64
+import shutil
+import tempfile
+import threading
+from types import SimpleNamespace
+from collections import defaultdict, deque
+
+import requests
+from twitter import TwitterError
+from imgurpython import ImgurClient
+
+from chirplib.giphy import GIPHY_API
+from chirplib.memes import ImgurMeme, Meme
+from chirplib.storage import MemeStore, MemoryStore
+
+RECORD = "record"
+REPLAY = "replay"
+
+VERSION = 1
+
+# Separates a subreddit from its clone number when replay multiplies subreddits
+CLONE_SEP = '~'
+
+
+class CassetteMissError(Exception):
+    pass
+
+
+class Cassette(object):
+    """ Gzipped JSON-lines log of every upstream call a Chirp run makes
+
+        Each line is [kind, key, latency, value]. In record mode calls go through
+        to the real client and are appended as they complete. In replay mode
+        they're answered from the log, sleeping for the recorded latency divided
+        by speedup (0 to not sleep at all). Replays get a scratch_dir, removed
+        on close, for state that mustn't touch production
+    """
+    def __init__(self, path, mode, speedup=1.0):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("Cassette mode not recognized: {0}".format(mode))
+
+        self.path = path
+        self.mode = mode
+        self.speedup = speedup
+
+        # (kind, key) -> recorded (latency, value) pairs, in call order
+        self.entries = defaultdict(deque)
+        # kind -> every recorded (latency, value) pair, for keys we never saw
+        self.by_kind = defaultdict(list)
+        self._next = defaultdict(int)
+        # Stage threads record alongside the main thread
+        self._lock = threading.Lock()
+
+        if mode == RECORD:
+            self.scratch_dir = None
+            self._out = gzip.open(path, 'wt', encoding='utf-8')
+            self._out.write(json.dumps({'version': VERSION, 'recorded': time.time()}) + '\n')
+        else:
+            self.scratch_dir = tempfile.mkdtemp(prefix='chirp-replay-')
+            self._out = None
+            self._load()
+
+    @property
+    def recording(self):
+        return self.mode == RECORD
+
+    def call(self, kind, key, func, encode=None, decode=None, error_type=None, fallback=True):
+        '''
+        Records or replays one upstream call
+
+        :param func: Makes the real call; only used when recording
+        :param encode: Turns the result into something JSON serialisable
+        :param decode: Turns the recorded value back into a result
+        :param error_type: Exception type to record and re-raise, if any
+        :param fallback: On replay, answer keys never recorded with other
+            recordings of the same kind, round robin
+        '''
+        if self.recording:
+            begin = time.time()
+            try:
+                result = func()
+            except Exception as exc:
+                if error_type is None or not isinstance(exc, error_type):
+                    raise
+                self.write(kind, key, time.time() - begin, {'raise': str(exc)})
+                raise
+
+            value = encode(result) if encode else result
+            self.write(kind, key, time.time() - begin, {'return': value})
+            return result
+
+        latency, value = self.lookup(kind, key, fallback)
+        if self.speedup:
+            time.sleep(latency / self.speedup)
+
+        if 'raise' in value:
+            raise (error_type or CassetteMissError)(value['raise'])
+
+        return decode(value['return']) if decode else value['return']
+
+    def write(self, kind, key, latency, value):
+        line = json.dumps([kind, key, round(latency, 4), value], default=vars)
+        with self._lock:
+            self._out.write(line + '\n')
+
+    def lookup(self, kind, key, fallback=True):
+        '''
+        Returns the next recorded (latency, value) for kind and key
+        '''
+        recorded = self.entries.get((kind, key))
+        if recorded:
+            # Cycle, so a replay multiplied past the recording keeps going
+            entry = recorded.popleft()
+            recorded.append(entry)
+            return entry
+
+        if fallback and self.by_kind.get(kind):
+            entries = self.by_kind[kind]
+            entry = entries[self._next[kind] % len(entries)]
+            self._next[kind] += 1
+            return entry
+
+        raise CassetteMissError("Nothing recorded for {0} {1}".format(kind, key))
+
+    def has(self, kind, key):
+        return bool(self.entries.get((kind, key)))
+
+    def install(self, chirp, multiply=1):
+        '''
+        Routes every upstream call chirp makes through this cassette. On replay,
+        each subreddit is additionally cloned multiply times
+        '''
+        session = CassetteSession(self, chirp.transport.session)
+        Meme.set_session(session)
+        if chirp.media is not None:
+            chirp.media.session = session
+        if chirp.giphy is not None:
+            chirp.giphy.session = session
+
+        credentials = (ImgurMeme.client_id, ImgurMeme.client_secret)
+        ImgurMeme._client = CassetteImgurClient(  # pylint: disable=protected-access
+            self, lambda: ImgurClient(*credentials))
+
+        chirp._reddit = CassetteReddit(self, chirp._connect_reddit)  # pylint: disable=W0212
+        chirp._api = CassetteTwitter(self, chirp._connect_twitter)  # pylint: disable=W0212
+        chirp.store = CassetteStore(self, chirp.store)
+
+        if not self.recording and multiply > 1:
+            chirp.subreddits = chirp.subreddits + [
+                "{0}{1}{2}".format(sub, CLONE_SEP, clone)
+                for clone in range(1, multiply) for sub in chirp.subreddits]
+
+    def close(self):
+        if self._out is not None:
+            with self._lock:
+                self._out.close()
+        if self.scratch_dir is not None:
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
+
+    def _load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as cassette:
+            header = json.loads(next(cassette))
+            if header.get('version') != VERSION:
+                exc_str = "Cassette version {0} not supported, expected {1}"
+                raise ValueError(exc_str.format(header.get('version'), VERSION))
+
+            for line in cassette:
+                kind, key, latency, value = json.loads(line)
+                self.entries[(kind, key)].append((latency, value))
+                self.by_kind[kind].append((latency, value))
+
+
+class _Lazy(object):
+    """ Only builds the real client once something is recorded, so replay never
+        touches the network
+    """
+    def __init__(self, cassette, factory):
+        self.cassette = cassette
+        self._factory = factory
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._factory()
+        return self._client
+
+
+class CassetteReddit(_Lazy):
+    """ Stands in for praw.Reddit, recording listings one submission at a time
+        so a lazily consumed listing records only what was actually fetched
+    """
+    def get_subreddit(self, subreddit):
+        return SimpleNamespace(get_hot=lambda **kwargs: self._get_hot(subreddit, **kwargs))
+
+    def _get_hot(self, subreddit, **kwargs):
+        # Pages after the first are keyed by the submission they follow
+        after = (kwargs.get('params') or {}).get('after')
+
+        if self.cassette.recording:
+            page = subreddit if after is None else "{0}@{1}".format(subreddit, after)
+            listing = iter(self.client.get_subreddit(subreddit).get_hot(**kwargs))
+            index = 0
+            while True:
+                # Page fetches happen inside next(), so that's where latency goes
+                begin = time.time()
+                try:
+                    submission = next(listing)
+                except StopIteration:
+                    return
+
+                value = {'url': submission.url,
+                         'title': submission.title,
+                         'over_18': submission.over_18,
+                         'fullname': submission.fullname}
+                self.cassette.write('reddit.listing', "{0}/{1}".format(page, index),
+                                    time.time() - begin, {'return': value})
+                yield submission
+                index += 1
+
+        recorded, _, clone = subreddit.partition(CLONE_SEP)
+        page = recorded if after is None else "{0}@{1}".format(recorded, after)
+        index = 0
+        while self.cassette.has('reddit.listing', "{0}/{1}".format(page, index)):
+            submission = self.cassette.call('reddit.listing', "{0}/{1}".format(page, index),
+                                            None, decode=lambda v: SimpleNamespace(**v))
+            if clone:
+                # Make cloned memes distinct, without breaking link classification
+                submission.url = "{0}#{1}".format(submission.url, clone)
+            yield submission
+            index += 1
+
+
+class CassetteImgurClient(_Lazy):
+    """ Stands in for ImgurClient
+    """
+    def get_image(self, image_id):
+        return self._call('get_image', image_id)
+
+    def get_album(self, album_id):
+        return self._call('get_album', album_id)
+
+    def gallery_item(self, item_id):
+        return self._call('gallery_item', item_id)
+
+    def _call(self, method, item_id):
+        return self.cassette.call('imgur.' + method, item_id,
+                                  lambda: getattr(self.client, method)(item_id),
+                                  encode=vars, decode=lambda v: SimpleNamespace(**v))
+
+
+class CassetteTwitter(_Lazy):
+    """ Stands in for twitter.Api
+    """
+    def PostUpdate(self, status, media=None, **kwargs):  # pylint: disable=invalid-name
+        return self.cassette.call('twitter.PostUpdate', status,
+                                  lambda: self.client.PostUpdate(status, media=media, **kwargs),
+                                  encode=lambda result: result.AsDict(),
+                                  decode=lambda v: SimpleNamespace(**v),
+                                  error_type=TwitterError)
+
+
+class CassetteResponse(object):
+    """ Just enough of requests.Response for the memes and media code
+    """
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError("{0} replayed from cassette".format(self.status_code))
+
+
+class CassetteSession(object):
+    """ Stands in for the pooled requests.Session, for plain GETs
+    """
+    def __init__(self, cassette, session):
+        self.cassette = cassette
+        self.session = session
+
+    def get(self, url, **kwargs):
+        # Any other GIF's metadata would pick, and cache, the wrong rendition
+        fallback = not url.startswith(GIPHY_API.format(''))
+        try:
+            return self.cassette.call('http.get', url,
+                                      lambda: self.session.get(url, **kwargs),
+                                      encode=self._encode, decode=self._decode,
+                                      fallback=fallback)
+        except CassetteMissError as exc:
+            # Callers treat it like any other failed request
+            raise requests.ConnectionError(str(exc))
+
+    @staticmethod
+    def _encode(resp):
+        return {'status': resp.status_code,
+                'content_type': resp.headers.get('Content-Type', ''),
+                'content': base64.b64encode(resp.content).decode('ascii')}
+
+    @staticmethod
+    def _decode(value):
+        return CassetteResponse(value['status'], {'Content-Type': value['content_type']},
+                                base64.b64decode(value['content']))
+
+
+class CassetteStore(MemeStore):
+    """ Records which links the store knew about. On replay those links seed an
+        in-memory store, so dedup answers don't depend on call order
+    """
+    def __init__(self, cassette, store):
+        self.cassette = cassette
+
+        if cassette.recording:
+            self.store = store
+            self.latency = 0
+        else:
+            store.close()
+            self.store = MemoryStore()
+            latencies = [latency for latency, _ in cassette.by_kind['store.contains_many']]
+            for _, value in cassette.by_kind['store.contains_many']:
+                self.store.add_many((link, 'cassette') for link in value['return'])
+            self.latency = sum(latencies) / len(latencies) if latencies else 0
+
+    def contains_many(self, links):
+        if self.cassette.recording:
+            return self.cassette.call('store.contains_many', '',
+                                      lambda: self.store.contains_many(links), encode=sorted)
+
+        if self.cassette.speedup:
+            time.sleep(self.latency / self.cassette.speedup)
+        return self.store.contains_many(links)
+
+    def add_many(self, memes):
+        self.store.add_many(memes)
+
+    def prune(self, before, archive=False):
+        return self.store.prune(before, archive)
+
+    def compact(self):
+        self.store.compact()
+
+    def close(self):
+        self.store.close()
@@ -1,18 +1,33 @@
 from __future__ import print_function
 
+import os
 import random
-from datetime import datetime as dt
+import resource
+import tempfile
+from datetime import datetime as dt, timedelta
+from itertools import islice
+from urllib.parse import urlparse
 
 import praw
+import requests
 import twitter
-import MySQLdb as mdb
+from praw.handlers import DefaultHandler
 from retryz import retry
 from twitter import TwitterError
 from praw.errors import HTTPException
 
+from chirplib import media
+from chirplib.budget import BudgetExceeded, RunBudget
+from chirplib.candidates import CandidateQueue, DEFAULT_TTL
+from chirplib.giphy import GiphyResolver
+from chirplib.recorder import WriteBehindStore
+from chirplib.sharding import DEFAULT_LEASE_TTL, DEFAULT_SHARDS, ShardCoordinator
+from chirplib.storage import get_store
+from chirplib.transport import Transport
 from chirplib.memes import (DankMeme,
                             GiphyMeme,
                             ImgurMeme,
+                            Meme,
                             RedditUploadsMeme,
                             ShowerThoughtsMeme,
                             YoutubeMeme,
@@ -21,6 +36,9 @@ from chirplib.memes import (DankMeme,
 IN_DB = "In database"
 POSTED = "Posted"
 
+# Build the user_agent, this is important to conform to Reddit's rules
+USER_AGENT = 'linux:chirpscraper:0.0.1 (by /u/IHKAS1984)'
+
 
 class Chirp(object):  # pylint: disable=R0902, R0903
     '''
@@ -31,23 +49,84 @@ class Chirp(object):  # pylint: disable=R0902, R0903
 
         self.twitter = config['twitter']
 
-        self.database = config['mysql']['database']
-        self.username = config['mysql']['username']
-        self.password = config['mysql']['password']
+        # Get logger
+        self.logger = logger
+
+        # Every outbound HTTP request goes through this pooled session where
+        # the client library lets us hand it one
+        self.transport = Transport.from_config(config)
+        Meme.set_session(self.transport.session)
+
+        # Upper bound on a whole run; HTTP timeouts are capped to what's left
+        self.budget = RunBudget(config.getfloat('budget', 'deadline', fallback=0))
+        self.transport.session.budget = self.budget
+        self._reddit = None
+        self._api = None
+
+        self.store = get_store(config)
+        journal = config.get('storage', 'journal', fallback=None)
+        if journal:
+            self.store = WriteBehindStore(
+                self.store, journal,
+                batch_size=config.getint('storage', 'batch_size', fallback=50),
+                flush_interval=config.getfloat('storage', 'flush_interval', fallback=5.0),
+                logger=logger)
 
         self.include_nsfw = config.getboolean('misc', 'include_nsfw')
         self.max_memes = config.getint('misc', 'max_memes')
 
         self.subreddits = [s.strip(',') for s in config['reddit']['subreddits'].split()]
 
+        # Streaming pulls hot listings a page at a time, dedup-checking memes in
+        # small batches, and stops once enough fresh ones are buffered
+        self.stream_listings = config.getboolean('reddit', 'stream', fallback=False)
+        self.page_size = config.getint('reddit', 'page_size', fallback=25)
+        self.max_pages = config.getint('reddit', 'max_pages', fallback=4)
+        self.dedup_batch = config.getint('reddit', 'dedup_batch', fallback=10)
+        self.fresh_buffer = config.getint('reddit', 'buffer', fallback=5)
+        self.listing_pages = 0
+        self.listing_memes = 0
+
+        # Candidate queue shared by `chirp harvest` and `chirp post`
+        self.queue_path = config.get('queue', 'path', fallback='/var/lib/chirp/candidates.db')
+        self.queue_size = config.getint('queue', 'size', fallback=50)
+        self.queue_ttl = config.getint('queue', 'ttl', fallback=DEFAULT_TTL)
+
+        # Memes older than this can be reposted; `chirp maintain` prunes them
+        self.dedup_window = config.getint('maintenance', 'dedup_window', fallback=180)
+        self.archive_memes = config.getboolean('maintenance', 'archive', fallback=True)
+
+        # Coordinated harvesting across workers, for `chirp worker`
+        self.shards = None
+        self.worker_id = config.get('sharding', 'worker_id', fallback=None)
+        self.shard_count = config.getint('sharding', 'shards', fallback=DEFAULT_SHARDS)
+        self.lease_ttl = config.getint('sharding', 'lease_ttl', fallback=DEFAULT_LEASE_TTL)
+
         # Get and set Imgur API credentials
         client_id = config['imgur']['client_id']
         client_secret = config['imgur']['client_secret']
 
         ImgurMeme.set_credentials(client_id=client_id, client_secret=client_secret)
 
-        # Get logger
-        self.logger = logger
+        # With an API key, post the smallest Giphy rendition that fits
+        self.giphy = None
+        if config.get('giphy', 'api_key', fallback=None):
+            self.giphy = GiphyResolver(
+                config['giphy']['api_key'],
+                config.get('giphy', 'cache', fallback='/var/lib/chirp/giphy.db'),
+                session=self.transport.session)
+        GiphyMeme.set_resolver(self.giphy)
+
+        # Optionally fit media to Twitter's upload limits before posting
+        self.media = None
+        if config.getboolean('media', 'enabled', fallback=False):
+            if media.available():
+                self.media = media.MediaPreprocessor(
+                    config.get('media', 'cache_dir', fallback='/var/cache/chirp/media'),
+                    max_workers=config.getint('media', 'workers', fallback=None),
+                    session=self.transport.session, logger=logger)
+            else:
+                self.logger.warning("Media preprocessing enabled but Pillow isn't installed")
 
     def find_and_post_memes(self):
         """ Find memes from subreddits and post them to Twitter
@@ -62,32 +141,226 @@ class Chirp(object):  # pylint: disable=R0902, R0903
             if ret_status:
                 break
         else:
-            log = "Couldn't find a fresh meme to post. Exiting"
-            self.logger.info(log)
+            if self.budget.expired:
+                log = "No post within budget of {0}s. Exiting"
+                self.logger.info(log.format(self.budget.deadline))
+            else:
+                log = "Couldn't find a fresh meme to post. Exiting"
+                self.logger.info(log)
+
+    def close(self):
+        """ Release the connections held by this bot
+        """
+        self.store.close()
+        if self.media is not None:
+            self.media.close()
+        if self.giphy is not None:
+            self.giphy.close()
+
+        self.end_run()
+        self.logger.info("HTTP connection use:\n\t{0}".format(self.transport.format_stats()))
+        self.transport.close()
+
+    def end_run(self):
+        """ Log where this run's time went and what it fetched, then start afresh
+        """
+        # ru_maxrss is in kilobytes on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        log = "Reddit listings: {0} pages, {1} memes. Peak memory: {2:.1f} MB"
+        self.logger.info(log.format(self.listing_pages, self.listing_memes, peak))
+        self.logger.info("Run budget:\n\t{0}".format(self.budget.report()))
+
+        self.listing_pages = 0
+        self.listing_memes = 0
+        self.budget.restart()
+
+    @property
+    def reddit(self):
+        """ praw client, shared across subreddits
+        """
+        if self._reddit is None:
+            self._reddit = self._connect_reddit()
+        return self._reddit
+
+    @property
+    def api(self):
+        """ Twitter API client, shared across posts
+        """
+        if self._api is None:
+            self._api = self._connect_twitter()
+        return self._api
+
+    def _connect_reddit(self):
+        self.logger.info("User agent: {0}".format(USER_AGENT))
+
+        # Send through our session
+        handler = DefaultHandler()
+        handler.http = self.transport.session
+
+        r_client = praw.Reddit(user_agent=USER_AGENT, handler=handler)
+        r_client.config.timeout = self.transport.timeout
+
+        return r_client
+
+    def _connect_twitter(self):
+        api = twitter.Api(consumer_key=self.twitter['consumer_key'],
+                          consumer_secret=self.twitter['consumer_secret'],
+                          access_token_key=self.twitter['access_token_key'],
+                          access_token_secret=self.twitter['access_token_secret'])
+
+        # Send through our session
+        api._session = self.transport.session  # pylint: disable=protected-access
+
+        return api
+
+    def harvest(self, subreddits=None):
+        """ Fill the candidate queue with fresh, digested memes for `post_candidate`
+        """
+        with CandidateQueue(self.queue_path, ttl=self.queue_ttl) as queue:
+            expired = queue.purge_expired()
+            self.logger.info("Dropped {0} expired candidates".format(expired))
+
+            memes = list()
+            if len(queue) < self.queue_size:
+                for meme in self._meme_gen(skip=queue.__contains__, subreddits=subreddits):
+                    memes.append(meme)
+                    if len(queue) + len(memes) >= self.queue_size:
+                        break
+
+            queued = sum(1 for meme in self._fit_media(memes) if queue.push(meme))
+
+            log = "Queued {0} new candidates, {1} waiting"
+            self.logger.info(log.format(queued, len(queue)))
+
+        return queued
 
-    def _meme_gen(self):
+    def harvest_shards(self):
+        """ Harvest just the subreddits in shards this worker holds a lease on
+
+            The candidate queue is a local SQLite file (WAL doesn't work over
+            network filesystems), so every worker must run on the same host
+        """
+        if self.shards is None:
+            # Lease through the database under any write-behind or cassette wrappers
+            store = self.store
+            while hasattr(store, 'store'):
+                store = store.store
+            self.shards = ShardCoordinator(store, worker_id=self.worker_id,
+                                           shards=self.shard_count, ttl=self.lease_ttl)
+
+        # Checked before heartbeating, so the host already harvesting carries on
+        others = [host for host in self.shards.live_hosts() if host != self.shards.host]
+        if others:
+            exc_str = ("Workers are live on other hosts ({0}), but the candidate queue "
+                       "at {1} is local to this one. Run every worker on one host")
+            raise ValueError(exc_str.format(', '.join(others), self.queue_path))
+
+        held = self.shards.rebalance()
+        subreddits = self.shards.subreddits_for(self.subreddits)
+
+        log = "Worker {0} holds {1} of {2} shards: {3} subreddits"
+        self.logger.info(log.format(self.shards.worker_id, len(held), self.shard_count,
+                                    len(subreddits)))
+
+        return self.harvest(subreddits=subreddits)
+
+    def leave_shards(self):
+        """ Hand this worker's shards back to the others
+        """
+        if self.shards is not None:
+            self.shards.leave()
+            self.shards = None
+
+    def maintain(self):
+        """ Prune memes older than the dedup window from the store, then compact it
+        """
+        cutoff = dt.now() - timedelta(days=self.dedup_window)
+        action = "Archived" if self.archive_memes else "Dropped"
+
+        pruned = self.store.prune(cutoff, archive=self.archive_memes)
+        self.logger.info("{0} {1} memes added before {2}".format(action, pruned, cutoff))
+
+        begin = dt.now()
+        self.store.compact()
+        self.logger.info("Compacted meme store in {0}".format(dt.now() - begin))
+
+        return pruned
+
+    def post_candidate(self):
+        """ Pop memes off the candidate queue until one is posted to Twitter
+        """
+        with CandidateQueue(self.queue_path, ttl=self.queue_ttl) as queue:
+            while True:
+                if self.budget.expired:
+                    log = "No post within budget of {0}s. Exiting"
+                    self.logger.info(log.format(self.budget.deadline))
+                    return False
+
+                meme = queue.pop()
+                if meme is None:
+                    log = "Candidate queue is empty, nothing to post. Exiting"
+                    self.logger.info(log)
+                    return False
+
+                # Another run may have posted it while it sat in the queue
+                if self.in_collection(meme):
+                    log = "Candidate already posted, skipping:\n\t{0}"
+                    self.logger.info(log.format(meme))
+                    continue
+
+                try:
+                    ret_status = self.post_to_twitter(meme)
+                except TwitterError:
+                    # Twitter's fault rather than the meme's: keep it for the
+                    # next run instead of draining the queue through an outage
+                    self.logger.exception("Caught TwitterError, requeueing candidate:")
+                    queue.push(meme)
+                    return False
+
+                if ret_status:
+                    return True
+
+    def _meme_gen(self, skip=None, subreddits=None):
         """ Meme generator. Queries subreddits and tracks supplied memes
+
+            skip is an optional callable; memes it returns True for are treated
+            as though they were already in the database. subreddits defaults to
+            every configured subreddit
         """
-        sr_memes = {sub: None for sub in self.subreddits}
+        subreddits = self.subreddits if subreddits is None else subreddits
+        sr_memes = {sub: None for sub in subreddits}
+        # Listings with memes we haven't pulled yet
+        listings = dict()
+
+        while True:
+            if self.budget.expired:
+                self.logger.info("Run budget spent, no more memes")
+                return
 
-        keep_generating = True
-        while keep_generating:
             # Pick a random subreddit that might still have viable memes
-            unchecked = [sub for sub in self.subreddits if sr_memes[sub] is None]
-            incomplete = [sub for sub in self.subreddits if sub not in unchecked]
-            incomplete = [sub for sub in incomplete if not all(sr_memes[sub].values())]
+            unchecked = [sub for sub in subreddits if sr_memes[sub] is None]
+            incomplete = [sub for sub in subreddits if sub not in unchecked]
+            incomplete = [sub for sub in incomplete
+                          if sub in listings or not all(sr_memes[sub].values())]
+
+            # Every meme in every subreddit has been tried
+            if not unchecked + incomplete:
+                return
+
             sub = random.choice(unchecked + incomplete)
 
-            # If we haven't already, get memes for that subreddit
+            # If we haven't already, start on that subreddit's listing
             if sr_memes[sub] is None:
                 sr_memes[sub] = dict()
-                memes = self._get_subreddit_memes(sub)
-                for meme in memes:
-                    sr_memes[sub][meme] = IN_DB if self.in_collection(meme) else None
+                listings[sub] = self._subreddit_listing(sub)
 
-                # Make sure we have fresh memes to post
-                if None not in sr_memes[sub].values():
-                    continue
+            # Top up its fresh memes from the listing
+            if sub in listings:
+                self._pull_memes(sub, sr_memes[sub], listings, skip)
+
+            # Make sure we have fresh memes to post
+            if None not in sr_memes[sub].values():
+                continue
 
             # Get a meme
             memes = [m for m in sr_memes[sub] if sr_memes[sub][m] is None]
@@ -95,7 +368,7 @@ class Chirp(object):  # pylint: disable=R0902, R0903
 
             try:
                 if isinstance(meme, ImgurMeme):
-                    meme.digest()
+                    self.budget.run('imgur', meme.digest)
             except Exception:  # pylint: disable=C0103, W0612, W0703
                 self.logger.exception("Caught exception while digesting Imgur meme")
             else:
@@ -103,12 +376,70 @@ class Chirp(object):  # pylint: disable=R0902, R0903
             finally:
                 sr_memes[sub][meme] = POSTED
 
-            # Check to see if we should exit
-            # Are all the subreddits in the tracking dict?
-            all_subs = all([sr_memes[sub] is not None for sub in self.subreddits])
-            # Have we attempted to post all the memes in the tracking dict?
-            all_tried = all([all(sub.values()) for sub in sr_memes.values() if sub is not None])
-            keep_generating = not all_subs or not all_tried
+    def _pull_memes(self, sub, tracked, listings, skip=None):
+        """ Pulls memes off sub's listing into tracked until enough fresh ones are
+            buffered, or the listing runs out. Streaming, that's a batch at a
+            time; otherwise the whole listing at once
+        """
+        batch_size = self.dedup_batch if self.stream_listings else None
+
+        while sub in listings and list(tracked.values()).count(None) < self.fresh_buffer:
+            try:
+                batch = self.budget.run('reddit', list, islice(listings[sub], batch_size))
+            except (BudgetExceeded, requests.RequestException) as exc:
+                # Timeouts are capped to the budget, so slow subreddits end up here
+                log = "Gave up on subreddit {0}: {1}"
+                self.logger.warning(log.format(sub, exc))
+                batch = []
+
+            # An abandoned listing may still be running, so it's never touched again
+            if batch_size is None or len(batch) < batch_size:
+                del listings[sub]
+
+            # Hot listings shift while we page through them
+            seen = {meme.link for meme in tracked}
+            batch = [meme for meme in batch if meme.link not in seen]
+            self.listing_memes += len(batch)
+
+            if skip is not None:
+                tracked.update({m: IN_DB for m in batch if skip(m)})
+                batch = [m for m in batch if m not in tracked]
+
+            # Not run on a budget thread, as an abandoned query would still hold
+            # the store's connection; MySQL's read_timeout bounds it instead
+            with self.budget.track('dedup'):
+                known = self.in_collection_many(batch)
+            for meme in batch:
+                tracked[meme] = IN_DB if meme.link in known else None
+
+    def _subreddit_listing(self, subreddit):
+        '''
+        Lazily yields memes from subreddit. Streaming, each page of the hot
+        listing is only fetched once the one before it is used up
+        '''
+        if not self.stream_listings:
+            for meme in self._get_subreddit_memes(subreddit) or []:
+                yield meme
+            return
+
+        after = None
+        for _ in range(self.max_pages):
+            try:
+                page = self._get_listing_page(self.reddit, subreddit, self.page_size, after)
+            except (HTTPException, requests.RequestException):
+                log = "API failed to get memes for subreddit: {0}"
+                self.logger.exception(log.format(subreddit))
+                return
+            self.listing_pages += 1
+
+            for submission in page:
+                meme = self._to_meme(submission, subreddit)
+                if meme is not None:
+                    yield meme
+
+            if len(page) < self.page_size:
+                return
+            after = page[-1].fullname
 
     def _get_subreddit_memes(self, subreddit):
         '''
@@ -116,31 +447,28 @@ class Chirp(object):  # pylint: disable=R0902, R0903
         '''
         self.logger.debug("Collecting memes from subreddit: {0}".format(subreddit))
 
-        # Build the user_agent, this is important to conform to Reddit's rules
-        user_agent = 'linux:chirpscraper:0.0.1 (by /u/IHKAS1984)'
-        self.logger.info("User agent: {0}".format(user_agent))
-
-        # Create connection object
-        r_client = praw.Reddit(user_agent=user_agent)
-
         # Get list of memes, filtering out NSFW entries
         try:
-            subreddit_memes = self._get_memes_from_subreddit(r_client, subreddit)
-        except HTTPException:
+            subreddit_memes = self._get_memes_from_subreddit(self.reddit, subreddit)
+        except (HTTPException, requests.RequestException):
             log = "API failed to get memes for subreddit: {0}"
             self.logger.exception(log.format(subreddit))
             return
+        self.listing_pages += 1
 
-        memes = list()
-        for meme in subreddit_memes:
-            if meme.over_18 and not self.include_nsfw:
-                continue
-            elif "/comments/" in meme.url:
-                continue
-            else:
-                memes.append(self._get_meme_object(meme, subreddit))
+        memes = [self._to_meme(meme, subreddit) for meme in subreddit_memes]
+        return [meme for meme in memes if meme is not None]
 
-        return memes
+    def _to_meme(self, submission, subreddit):
+        '''
+        Meme object for a listing submission, or None if we don't post it
+        '''
+        if submission.over_18 and not self.include_nsfw:
+            return None
+        elif "/comments/" in submission.url:
+            return None
+
+        return self._get_meme_object(submission, subreddit)
 
     @staticmethod
     def _get_meme_object(meme, subreddit):
@@ -162,57 +490,44 @@ class Chirp(object):  # pylint: disable=R0902, R0903
     @staticmethod
     @retry(on_error=HTTPException, limit=3, wait=2)
     def _get_memes_from_subreddit(client, subreddit):
-        return client.get_subreddit(subreddit).get_hot()
+        # Listings are lazy; fetch here, where errors are retried and caught
+        return list(client.get_subreddit(subreddit).get_hot())
+
+    @staticmethod
+    @retry(on_error=HTTPException, limit=3, wait=2)
+    def _get_listing_page(client, subreddit, limit, after=None):
+        params = {'after': after} if after else None
+        return list(client.get_subreddit(subreddit).get_hot(limit=limit, params=params))
 
     def in_collection(self, meme):
         '''
         Checks to see if the supplied meme is already in the collection of known
         memes
         '''
-        query = "SELECT * FROM memes WHERE links = '%s'" % meme.link
-
-        con = mdb.connect(
-            'localhost',
-            self.username,
-            self.password,
-            self.database,
-            charset='utf8'
-        )
-
-        with con, con.cursor() as cur:
-            try:
-                resp = cur.execute(query)
-            except UnicodeEncodeError:
-                # Indicates a link with oddball characters, just ignore it
-                resp = True
-
-                log = "Bad character in meme: {0}"
-                self.logger.exception(log.format(meme))
-
-        return True if resp else False
+        try:
+            return self.store.contains(meme.link)
+        except UnicodeEncodeError:
+            # Indicates a link with oddball characters, just ignore it
+            log = "Bad character in meme: {0}"
+            self.logger.exception(log.format(meme))
+            return True
+
+    def in_collection_many(self, memes):
+        '''
+        Returns the set of links, out of the supplied memes, that are already in
+        the collection of known memes
+        '''
+        try:
+            return self.store.contains_many([meme.link for meme in memes])
+        except UnicodeEncodeError:
+            # One bad link spoils the batch, fall back to checking one at a time
+            return {meme.link for meme in memes if self.in_collection(meme)}
 
     def add_to_collection(self, meme):
         '''
         Adds a meme to the collection
         '''
-        query = """INSERT INTO memes
-                   (links, sources, datecreated)
-                   VALUES
-                   ('%s', '%s', '%s')
-                """ % (meme.link, meme.source, str(dt.now()))
-
-        con = mdb.connect(
-            'localhost',
-            self.username,
-            self.password,
-            self.database,
-            charset='utf8'
-        )
-
-        with con, con.cursor() as cur:
-            cur.execute(query)
-
-        return
+        self.store.add(meme.link, meme.source)
 
     def post_to_twitter(self, meme):
         '''
@@ -221,21 +536,16 @@ class Chirp(object):  # pylint: disable=R0902, R0903
         log = "Posting meme to twitter:\n\t{0}"
         self.logger.info(log.format(meme))
 
-        api = twitter.Api(consumer_key=self.twitter['consumer_key'],
-                          consumer_secret=self.twitter['consumer_secret'],
-                          access_token_key=self.twitter['access_token_key'],
-                          access_token_secret=self.twitter['access_token_secret'])
-
-        try:
-            message, media_link = meme.format_for_twitter()
-        except UndigestedError:
-            log = "Caught exception while formatting Imgur meme"
-            self.logger.exception(log)
-            message = "#memes #dankmemes #funny #{0}".format(meme.source)
-            media_link = meme.link
+        prepared = self._prepare_post(meme)
+        if prepared is None:
+            return False
+        message, media_link, media_file = prepared
 
         try:
-            api.PostUpdate(status=message, media=media_link)
+            # Not abandoned like other stages: a tweet that went out after we
+            # gave up would never be recorded. The HTTP timeouts are capped instead
+            with self.budget.track('twitter'):
+                self.api.PostUpdate(status=message, media=media_file or media_link)
         except TwitterError:
             raise
         except Exception:
@@ -245,5 +555,111 @@ class Chirp(object):  # pylint: disable=R0902, R0903
         else:
             self.add_to_collection(meme)
             ret_status = True
+        finally:
+            if media_file is not None:
+                media_file.close()
 
         return ret_status
+
+    def _prepare_post(self, meme):
+        '''
+        Returns the message, media link and downloaded media file (or None) to
+        post meme with, or None if it should be skipped
+        '''
+        try:
+            # Formatting may look the media up, e.g. reddituploads redirects
+            message, media_link = self.budget.run('format', self._format_for_twitter, meme)
+        except media.MediaTooLargeError:
+            log = "No rendition fits Twitter's limits, skipping:\n\t{0}"
+            self.logger.warning(log.format(meme))
+            return None
+        except (BudgetExceeded, requests.RequestException):
+            log = "Couldn't look up media, skipping:\n\t{0}"
+            self.logger.exception(log.format(meme))
+            return None
+
+        if self.media is not None:
+            try:
+                media_link = self.budget.run('media', self.media.prepare, media_link)
+            except media.MediaTooLargeError:
+                log = "Media can't be fit to Twitter's limits, skipping:\n\t{0}"
+                self.logger.warning(log.format(meme))
+                return None
+            except BudgetExceeded:
+                log = "Ran out of budget preparing media, skipping:\n\t{0}"
+                self.logger.warning(log.format(meme))
+                return None
+
+        try:
+            media_file = self._open_media(media_link)
+        except (BudgetExceeded, requests.RequestException):
+            log = "Couldn't download media, skipping:\n\t{0}"
+            self.logger.exception(log.format(meme))
+            return None
+
+        return message, media_link, media_file
+
+    def _open_media(self, media_link):
+        '''
+        Downloads remote media to a temporary file for PostUpdate, which would
+        otherwise fetch it with a bare requests.get and no timeout. Returns None
+        for local files and memes without media
+        '''
+        if not media_link or not media_link.startswith('http'):
+            return None
+
+        return self.budget.run('media', self._download_media, media_link)
+
+    @staticmethod
+    def _download_media(url):
+        # Through the pooled session, or the cassette's stand-in for it
+        resp = Meme.session.get(url)
+        resp.raise_for_status()
+
+        # python-twitter guesses the media type from the file name
+        suffix = os.path.splitext(urlparse(url).path)[1]
+        media_file = tempfile.NamedTemporaryFile(mode='w+b', suffix=suffix)
+        media_file.write(resp.content)
+        media_file.seek(0)
+
+        return media_file
+
+    def _format_for_twitter(self, meme):
+        try:
+            return meme.format_for_twitter()
+        except UndigestedError:
+            log = "Caught exception while formatting Imgur meme"
+            self.logger.exception(log)
+            message = "#memes #dankmemes #funny #{0}".format(meme.source)
+            return message, meme.link
+
+    def _fit_media(self, memes):
+        """ Preprocess media for a batch of memes in parallel, warming the media
+            cache and dropping memes whose media can never fit
+        """
+        if self.media is None or not memes:
+            return memes
+
+        fittable, links = list(), list()
+        for meme in memes:
+            try:
+                link = self._format_for_twitter(meme)[1]
+            except media.MediaTooLargeError:
+                log = "No rendition fits Twitter's limits, skipping:\n\t{0}"
+                self.logger.warning(log.format(meme))
+                continue
+            except Exception:  # pylint: disable=W0703
+                # Leave it for post_to_twitter to deal with
+                link = None
+            fittable.append(meme)
+            links.append(link)
+        memes = fittable
+
+        fitted = self.media.prepare_many(links)
+
+        for meme, path in zip(memes, fitted):
+            if path is media.REJECTED:
+                log = "Media can't be fit to Twitter's limits, skipping:\n\t{0}"
+                self.logger.warning(log.format(meme))
+
+        return [meme for meme, path in zip(memes, fitted) if path is not media.REJECTED]
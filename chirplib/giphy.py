@@ -0,0 +1,109 @@
+import re
+import time
+import sqlite3
+
+import requests
+
+from chirplib.media import (MAX_GIF_BYTES, MAX_GIF_HEIGHT, MAX_GIF_WIDTH, MAX_VIDEO_BYTES,
+                            MediaTooLargeError)
+
+GIPHY_API = "https://api.giphy.com/v1/gifs/{0}"
+
+# Renditions worth posting, as (rendition, url field, size field, size limit).
+# Stills and tiny previews are left out on purpose
+RENDITIONS = (
+    ('downsized', 'url', 'size', MAX_GIF_BYTES),
+    ('downsized_medium', 'url', 'size', MAX_GIF_BYTES),
+    ('downsized_large', 'url', 'size', MAX_GIF_BYTES),
+    ('original', 'url', 'size', MAX_GIF_BYTES),
+    ('downsized_small', 'mp4', 'mp4_size', MAX_VIDEO_BYTES),
+    ('original_mp4', 'mp4', 'mp4_size', MAX_VIDEO_BYTES),
+    ('original', 'mp4', 'mp4_size', MAX_VIDEO_BYTES),
+)
+
+# Matches the ID in page links (giphy.com/gifs/funny-lol-gif-fJIZa8yIfiEFi),
+# media links (media.giphy.com/media/fJIZa8yIfiEFi/giphy.gif) and direct links
+# (i.giphy.com/fJIZa8yIfiEFi.gif)
+GIPHY_ID = re.compile(r"giphy\.com/(?:gifs/(?:[^/]*-)?|media/|embed/)?([A-Za-z0-9]+)")
+
+
+def giphy_id(link):
+    """
+    Pulls the Giphy ID out of any of the link formats Reddit sees
+
+    :param link: Giphy link
+    """
+    match = GIPHY_ID.search(link.split('?')[0])
+    if match is None:
+        raise ValueError("Not a Giphy link: {0}".format(link))
+
+    return match.group(1)
+
+
+def pick_rendition(images):
+    """
+    Returns the URL of the smallest rendition within the Twitter upload limits,
+    or None if none of them fit
+
+    :param images: The `images` object from Giphy's metadata
+    """
+    candidates = list()
+    for name, url_field, size_field, limit in RENDITIONS:
+        rendition = images.get(name) or {}
+        try:
+            url = rendition[url_field]
+            size = int(rendition[size_field])
+            width, height = int(rendition['width']), int(rendition['height'])
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        if size <= limit and width <= MAX_GIF_WIDTH and height <= MAX_GIF_HEIGHT:
+            candidates.append((size, url))
+
+    return min(candidates)[1] if candidates else None
+
+
+class GiphyResolver(object):
+    """ Looks up Giphy metadata to find the rendition to post, remembering the
+        answer per Giphy ID so each GIF is only looked up once
+    """
+    def __init__(self, api_key, cache_path, session=None):
+        self.api_key = api_key
+        self.session = session or requests
+
+        self.con = sqlite3.connect(cache_path, timeout=30)
+        self.con.execute("""CREATE TABLE IF NOT EXISTS renditions
+                            (giphy_id TEXT PRIMARY KEY,
+                             url TEXT,
+                             resolved REAL NOT NULL)
+                         """)
+        self.con.commit()
+
+    def resolve(self, link):
+        '''
+        Returns the media URL to post for a Giphy link. Raises
+        MediaTooLargeError if no rendition fits the Twitter upload limits
+        '''
+        gif_id = giphy_id(link)
+
+        row = self.con.execute("SELECT url FROM renditions WHERE giphy_id = ?",
+                               (gif_id, )).fetchone()
+        if row is not None:
+            url = row[0]
+        else:
+            resp = self.session.get(GIPHY_API.format(gif_id), params={'api_key': self.api_key})
+            resp.raise_for_status()
+            url = pick_rendition(resp.json()['data']['images'])
+
+            # A NULL url remembers that nothing fits
+            self.con.execute("INSERT OR REPLACE INTO renditions (giphy_id, url, resolved) "
+                             "VALUES (?, ?, ?)", (gif_id, url, time.time()))
+            self.con.commit()
+
+        if url is None:
+            raise MediaTooLargeError("No Giphy rendition fits Twitter limits: {0}".format(link))
+
+        return url
+
+    def close(self):
+        self.con.close()
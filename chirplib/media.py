@@ -0,0 +1,253 @@
+import os
+import hashlib
+import logging
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import requests
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:  # Pillow is an optional dependency, see extras_require
+    Image = ImageSequence = None
+
+# Twitter upload limits
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+MAX_IMAGE_DIMENSION = 4096
+MAX_GIF_BYTES = 15 * 1024 * 1024
+MAX_GIF_WIDTH = 1280
+MAX_GIF_HEIGHT = 1080
+MAX_GIF_FRAMES = 350
+MAX_VIDEO_BYTES = 15 * 1024 * 1024
+
+# Formats Twitter accepts as still images without conversion
+IMAGE_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+JPEG_QUALITIES = (85, 75, 65, 50)
+MAX_SHRINKS = 4
+
+# Written next to cached media for downloads that can't be made to fit
+REJECT_SUFFIX = '.reject'
+
+# Stands in for media that can't be made to fit in prepare_many results
+REJECTED = object()
+
+
+class MediaTooLargeError(Exception):
+    pass
+
+
+def available():
+    """ Whether Pillow is installed, and so whether preprocessing can run
+    """
+    return Image is not None
+
+
+def fit_media(data, cache_base):
+    """
+    Resize and recompress an image or GIF until it fits the Twitter upload
+    limits. Runs in a worker process, so everything it needs is passed in
+
+    :param data: Bytes of the downloaded media
+    :param cache_base: Cache path without extension; the format decides the extension
+    :returns: Path of the cached, upload-ready file
+    """
+    img = Image.open(BytesIO(data))
+
+    if img.format == 'GIF' and getattr(img, 'is_animated', False):
+        output, ext = _fit_gif(img, data)
+    else:
+        output, ext = _fit_image(img, data)
+
+    path = "{0}.{1}".format(cache_base, ext)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        out.write(output)
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def _fit_image(img, data):
+    fits_dims = max(img.size) <= MAX_IMAGE_DIMENSION
+    if img.format in IMAGE_FORMATS and fits_dims and len(data) <= MAX_IMAGE_BYTES:
+        return data, IMAGE_FORMATS[img.format]
+
+    img = img.convert('RGB')
+    img.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+
+    for _ in range(MAX_SHRINKS):
+        for quality in JPEG_QUALITIES:
+            buf = BytesIO()
+            img.save(buf, 'JPEG', quality=quality, optimize=True)
+            if buf.tell() <= MAX_IMAGE_BYTES:
+                return buf.getvalue(), 'jpg'
+
+        img = img.resize((img.width // 2, img.height // 2))
+
+    exc_str = "Couldn't fit image under {0} bytes"
+    raise MediaTooLargeError(exc_str.format(MAX_IMAGE_BYTES))
+
+
+def _fit_gif(img, data):
+    fits_dims = img.width <= MAX_GIF_WIDTH and img.height <= MAX_GIF_HEIGHT
+    if fits_dims and img.n_frames <= MAX_GIF_FRAMES and len(data) <= MAX_GIF_BYTES:
+        return data, 'gif'
+
+    durations = []
+    frames = []
+    for frame in ImageSequence.Iterator(img):
+        if len(frames) == MAX_GIF_FRAMES:
+            break
+        durations.append(frame.info.get('duration', 100))
+        frames.append(frame.convert('RGBA'))
+
+    scale = min(1.0, MAX_GIF_WIDTH / img.width, MAX_GIF_HEIGHT / img.height)
+
+    for _ in range(MAX_SHRINKS):
+        size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        resized = [frame.resize(size) for frame in frames]
+
+        buf = BytesIO()
+        resized[0].save(buf, 'GIF', save_all=True, append_images=resized[1:],
+                        duration=durations, loop=img.info.get('loop', 0), optimize=True)
+        if buf.tell() <= MAX_GIF_BYTES:
+            return buf.getvalue(), 'gif'
+
+        scale *= 0.75
+
+    exc_str = "Couldn't fit GIF under {0} bytes"
+    raise MediaTooLargeError(exc_str.format(MAX_GIF_BYTES))
+
+
+class MediaPreprocessor(object):
+    """ Downloads media and fits it to the Twitter upload limits ahead of posting,
+        caching results by content hash
+    """
+    def __init__(self, cache_dir, max_workers=None, session=None, timeout=30, logger=None):
+        if not available():
+            raise ImportError("Media preprocessing requires Pillow: pip install chirp[media]")
+
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.session = session or requests
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._pool = None
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @property
+    def pool(self):
+        # Spawning workers is slow, so only do it once there's work for them.
+        # By then budget and transport threads are running, and forking them
+        # can leave a worker holding a lock nobody will release
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context('forkserver'))
+        return self._pool
+
+    def prepare(self, link):
+        '''
+        Returns a local path to an upload-ready copy of the media at link, or
+        link itself if it isn't something we preprocess
+        '''
+        path = self.prepare_many([link])[0]
+        if path is REJECTED:
+            raise MediaTooLargeError("Media can't fit Twitter limits: {0}".format(link))
+
+        return path
+
+    def prepare_many(self, links):
+        '''
+        Like prepare, but fits every link in parallel. Links that can't be made
+        to fit come back as REJECTED; ones that can't be fetched, decoded or
+        processed for any other reason come back unchanged, leaving the
+        decision to Twitter
+        '''
+        results = list(links)
+        futures = self._submit(results)
+        self._gather(results, futures)
+
+        return results
+
+    def _submit(self, results):
+        """ Downloads every link in results, filling in cached and rejected ones
+            in place and submitting the rest to the pool. Returns
+            {index: (cache base, future)}
+        """
+        futures = dict()
+
+        for index, link in enumerate(results):
+            try:
+                job = self._download(link)
+            except MediaTooLargeError:
+                results[index] = REJECTED
+                continue
+            except requests.RequestException:
+                continue
+
+            if job is None:
+                continue
+
+            cached, data, cache_base = job
+            if cached is not None:
+                results[index] = cached
+            else:
+                futures[index] = (cache_base, self.pool.submit(fit_media, data, cache_base))
+
+        return futures
+
+    def _gather(self, results, futures):
+        """ Fills in results from the pool's work as it finishes
+        """
+        for index, (cache_base, future) in futures.items():
+            try:
+                results[index] = future.result()
+            except MediaTooLargeError:
+                open(cache_base + REJECT_SUFFIX, 'w').close()
+                results[index] = REJECTED
+            except (IOError, ValueError):
+                # Not something Pillow can decode, let Twitter have a go
+                pass
+            except Exception:  # pylint: disable=W0703
+                # e.g. DecompressionBombError; one bad meme mustn't end the run
+                log = "Caught exception preparing media, leaving it unchanged: {0}"
+                self.logger.exception(log.format(results[index]))
+                if isinstance(future.exception(), BrokenProcessPool):
+                    # A worker died; start afresh next time
+                    self._pool = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _download(self, link):
+        """ Fetch link, returning (cached path or None, data, cache base), or None
+            when the link isn't an image
+        """
+        if not link or not link.startswith('http'):
+            return None
+
+        resp = self.session.get(link, timeout=self.timeout)
+        resp.raise_for_status()
+
+        if not resp.headers.get('Content-Type', 'image/').startswith('image/'):
+            return None
+
+        cache_base = os.path.join(self.cache_dir, hashlib.sha1(resp.content).hexdigest())
+
+        if os.path.exists(cache_base + REJECT_SUFFIX):
+            raise MediaTooLargeError("Media previously rejected: {0}".format(link))
+
+        for ext in set(IMAGE_FORMATS.values()) | {'gif'}:
+            cached = "{0}.{1}".format(cache_base, ext)
+            if os.path.exists(cached):
+                return cached, None, cache_base
+
+        return None, resp.content, cache_base
@@ -12,6 +12,9 @@ class UndigestedError(Exception):
 class Meme(object):  # pylint: disable=R0903
     """ Base class for meme objects
     """
+    # Anything with a requests-style get(), normally Chirp's pooled session
+    session = requests
+
     def __init__(self, link, source):
         self.link = link
         self.source = source
@@ -25,6 +28,13 @@ class Meme(object):  # pylint: disable=R0903
     def __repr__(self):
         return "from {0}: {1}".format(self.source, self.link)
 
+    @classmethod
+    def set_session(cls, session):
+        """
+        Class method for setting the HTTP session memes make requests through
+        """
+        cls.session = session
+
     def format_for_slack(self):
         return repr(self)
 
@@ -41,10 +51,31 @@ class DankMeme(Meme):  # pylint: disable=too-few-public-methods
 class GiphyMeme(Meme):
     """ Giphy memes
     """
+    # chirplib.giphy.GiphyResolver, when a Giphy API key is configured
+    resolver = None
+
+    @classmethod
+    def set_resolver(cls, resolver):
+        """
+        Class method for setting the resolver used to pick a Giphy rendition
+        """
+        cls.resolver = resolver
+
     def format_for_twitter(self):
-        # Example link: http://giphy.com/gifs/funny-lol-gif-fJIZa8yIfiEFi
-        giphy_hash = self.link.split('-')[-1]
-        twitter_link = "https://media.giphy.com/media/{0}/giphy.gif".format(giphy_hash)
+        twitter_link = None
+        if self.resolver is not None:
+            # MediaTooLargeError, when no rendition fits, is left to the caller:
+            # the guess below would be the full size GIF that didn't fit
+            try:
+                twitter_link = self.resolver.resolve(self.link)
+            except (requests.RequestException, KeyError, ValueError):
+                twitter_link = None
+
+        if twitter_link is None:
+            # Example link: http://giphy.com/gifs/funny-lol-gif-fJIZa8yIfiEFi
+            giphy_hash = self.link.split('-')[-1]
+            twitter_link = "https://media.giphy.com/media/{0}/giphy.gif".format(giphy_hash)
+
         return "#memes #dankmemes #funny #{0}".format(self.source), twitter_link
 
 
@@ -73,7 +104,7 @@ class RedditUploadsMeme(Meme):
         """ URLs from reddituploads.com are odd. Download the file, and yield a
             file-like object to upload to Twitter
         """
-        resp = requests.get(self.link)
+        resp = self.session.get(self.link)
         resp.raise_for_status()
 
         with NamedTemporaryFile() as tf:
@@ -95,6 +126,10 @@ class ImgurMeme(Meme):
     client_id = None
     client_secret = None
 
+    # ImgurClient makes a request to fetch rate limit credits when it's created,
+    # so share one between memes
+    _client = None
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -111,7 +146,10 @@ class ImgurMeme(Meme):
         if not all([self.client_id, self.client_secret]):
             raise ValueError("Client ID and Secret must be set first")
 
-        return ImgurClient(self.client_id, self.client_secret)
+        if ImgurMeme._client is None:
+            ImgurMeme._client = ImgurClient(self.client_id, self.client_secret)
+
+        return ImgurMeme._client
 
     @classmethod
     def set_credentials(cls, client_id, client_secret):
@@ -120,6 +158,7 @@ class ImgurMeme(Meme):
         """
         cls.client_id = client_id
         cls.client_secret = client_secret
+        ImgurMeme._client = None
 
     def format_for_slack(self):
         """
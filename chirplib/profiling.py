@@ -0,0 +1,230 @@
+import os
+import sys
+import random
+import pstats
+import inspect
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import datetime as dt
+
+FULL = "full"
+SAMPLE = "sample"
+
+# Seconds between stack samples. Sample mode is meant to be left on in
+# production, so it looks far less often
+FULL_INTERVAL = 0.001
+SAMPLE_INTERVAL = 0.01
+
+TRACEMALLOC_FRAMES = 25
+TOP_STATS = 40
+
+# Re-snapshot once traced memory grows this much past the last snapshot.
+# Snapshots are expensive, so this is coarse
+PEAK_GROWTH = 1.5
+
+# The Profiler currently running, for profile_call
+_active = None
+
+
+class StackSampler(object):
+    """ Periodically samples thread stacks from a background thread, counting
+        collapsed stacks for flamegraph.pl / speedscope. Samples every thread,
+        each rooted at its name, unless given just one to sample
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL, thread_id=None, on_sample=None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.on_sample = on_sample
+        self.stacks = Counter()
+
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='chirp-stack-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def write_folded(self, path):
+        '''
+        Writes one "frame;frame;frame count" line per distinct stack, root first
+        '''
+        with open(path, 'w') as out:
+            for stack, count in self.stacks.most_common():
+                out.write("{0} {1}\n".format(stack, count))
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            frames = sys._current_frames()  # pylint: disable=W0212
+            if self.thread_id is not None:
+                frame = frames.get(self.thread_id)
+                if frame is not None:
+                    self.stacks[self._collapse(frame)] += 1
+            else:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in frames.items():
+                    if ident != own:
+                        stack = self._collapse(frame)
+                        self.stacks["{0};{1}".format(names.get(ident, ident), stack)] += 1
+
+            if self.on_sample is not None:
+                self.on_sample()
+
+    @staticmethod
+    def _collapse(frame):
+        names = list()
+        while frame is not None:
+            code = frame.f_code
+            names.append("{0}:{1}".format(os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+
+        return ';'.join(reversed(names))
+
+
+class Profiler(object):
+    """ Context manager profiling everything run inside it
+
+        Full mode writes a cProfile dump (profile.prof), a text summary of it
+        (profile.txt) and sampled collapsed stacks (stacks.folded). Sample mode
+        only collects the stacks, at a much lower rate. With trace_memory, a
+        tracemalloc snapshot taken at peak traced memory is summarised into
+        memory.txt, attributed to the lines of the memory_focus functions that
+        led to each allocation
+    """
+    def __init__(self, output_root, mode=FULL, trace_memory=False, memory_focus=()):
+        if mode not in (FULL, SAMPLE):
+            raise ValueError("Profiling mode not recognized: {0}".format(mode))
+
+        self.mode = mode
+        self.trace_memory = trace_memory
+        self.memory_focus = memory_focus
+
+        stamp = dt.now().strftime('%Y%m%d-%H%M%S.%f')
+        self.output_dir = os.path.join(output_root, "{0}-{1}".format(stamp, os.getpid()))
+
+        self._profile = None
+        # Profiles of functions run on other threads, through profile_call
+        self._thread_profiles = list()
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._snapshot = None
+        self._snapshot_size = 0
+
+    def __enter__(self):
+        global _active  # pylint: disable=global-statement
+
+        os.makedirs(self.output_dir)
+
+        on_sample = None
+        if self.trace_memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            on_sample = self._check_memory
+
+        interval = FULL_INTERVAL if self.mode == FULL else SAMPLE_INTERVAL
+        self._sampler = StackSampler(interval=interval, on_sample=on_sample)
+        self._sampler.start()
+
+        if self.mode == FULL:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+        _active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active  # pylint: disable=global-statement
+
+        _active = None
+        if self._profile is not None:
+            self._profile.disable()
+        self._sampler.stop()
+
+        if self.trace_memory:
+            if self._snapshot is None:
+                self._check_memory()
+            tracemalloc.stop()
+            self._write_memory(self._snapshot, self._snapshot_size)
+
+        self._sampler.write_folded(os.path.join(self.output_dir, 'stacks.folded'))
+
+        if self._profile is not None:
+            with self._lock:
+                profiles = [self._profile] + self._thread_profiles
+            with open(os.path.join(self.output_dir, 'profile.txt'), 'w') as out:
+                stats = pstats.Stats(*profiles, stream=out)
+                stats.dump_stats(os.path.join(self.output_dir, 'profile.prof'))
+                stats.sort_stats('cumulative').print_stats(TOP_STATS)
+
+    def _check_memory(self):
+        current = tracemalloc.get_traced_memory()[0]
+        if self._snapshot is None or current > self._snapshot_size * PEAK_GROWTH:
+            self._snapshot = tracemalloc.take_snapshot()
+            self._snapshot_size = current
+
+    def _write_memory(self, snapshot, peak):
+        # filename -> [(first line, last line)] for each function we care about
+        ranges = defaultdict(list)
+        for func in self.memory_focus:
+            lines, start = inspect.getsourcelines(func)
+            ranges[inspect.getsourcefile(func)].append((start, start + len(lines) - 1))
+
+        # Only traces passing through a focus file can be attributed
+        filters = [tracemalloc.Filter(True, filename, all_frames=True) for filename in ranges]
+        snapshot = snapshot.filter_traces(filters)
+
+        sites = defaultdict(lambda: [0, 0])
+        for trace in snapshot.traces:
+            # Attribute to the innermost frame inside a focus function
+            for frame in reversed(trace.traceback):
+                lines = ranges.get(frame.filename, ())
+                if any(start <= frame.lineno <= end for start, end in lines):
+                    site = sites["{0}:{1}".format(frame.filename, frame.lineno)]
+                    site[0] += trace.size
+                    site[1] += 1
+                    break
+
+        with open(os.path.join(self.output_dir, 'memory.txt'), 'w') as out:
+            out.write("{0} bytes traced at peak\n".format(peak))
+            focus = ', '.join(func.__qualname__ for func in self.memory_focus)
+            out.write("Top allocation sites in: {0}\n".format(focus or 'nothing'))
+
+            top = sorted(sites.items(), key=lambda item: item[1][0], reverse=True)
+            for site, (size, count) in top[:TOP_STATS]:
+                out.write("{0}: {1} bytes in {2} blocks\n".format(site, size, count))
+
+
+def profile_call(func, *args, **kwargs):
+    """
+    Calls func, folding its profile into the running full profile, if any.
+    cProfile only sees the thread that enabled it, so functions run on threads
+    of their own go through here
+    """
+    profiler = _active
+    if profiler is None or profiler._profile is None:  # pylint: disable=protected-access
+        return func(*args, **kwargs)
+
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *args, **kwargs)
+    finally:
+        with profiler._lock:  # pylint: disable=protected-access
+            profiler._thread_profiles.append(profile)  # pylint: disable=protected-access
+
+
+def should_sample(percent, rand=None):
+    """
+    Decides whether this run should be profiled in sample mode
+
+    :param percent: Percentage of runs to sample, 0-100
+    """
+    if percent <= 0:
+        return False
+
+    return (rand or random.random)() * 100 < percent
@@ -0,0 +1,230 @@
+import os
+import glob
+import json
+import fcntl
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+from chirplib.storage import MemeStore
+
+
+class WriteBehindStore(MemeStore):
+    """ Wraps a meme store so that adds never wait on the database
+
+        Added memes are appended to a local, fsync'd journal and then written to
+        the wrapped store in batches by a background thread. Lookups check the
+        unflushed memes before going to the wrapped store, and any journal left
+        over from a crash is replayed on startup
+
+        Every instance journals to its own file next to journal_path, with a
+        lock file held for as long as it runs, so `chirp harvest`, `post` and
+        `worker` can share one configured path. On startup, journals whose lock
+        is free belong to processes that are gone, and are taken over
+    """
+    def __init__(self, store, journal_path, batch_size=50, flush_interval=5.0, logger=None):
+        self.store = store
+        self.journal_base = journal_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.logger = logger or logging.getLogger(__name__)
+
+        # link -> source, for memes journaled but not yet in the wrapped store
+        self.pending = OrderedDict()
+
+        # lock guards pending and the journal; store_lock serialises use of the
+        # wrapped store's connection between the caller and the flush thread
+        self.lock = threading.Lock()
+        self.store_lock = threading.Lock()
+
+        # Locked before our journal exists, so no one else can take it over
+        fd, lock_path = tempfile.mkstemp(prefix=os.path.basename(journal_path) + '.',
+                                         suffix='.lock', dir=os.path.dirname(journal_path))
+        os.close(fd)
+        self.journal_path = lock_path[:-len('.lock')]
+        self._lock_file = self._try_lock(self.journal_path)
+
+        adopted = self._adopt_orphans()
+
+        # Rewritten rather than appended to, so nothing lands after a torn line
+        self.journal = None
+        self._rewrite_journal()
+
+        for path, lock_file in adopted.items():
+            _remove(path)
+            _remove(path + '.lock')
+            lock_file.close()
+
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='chirp-write-behind')
+        self._thread.daemon = True
+        self._thread.start()
+
+        if self.pending:
+            self._wakeup.set()
+
+    def contains_many(self, links):
+        links = list(links)
+        with self.lock:
+            found = {link for link in links if link in self.pending}
+
+        rest = [link for link in links if link not in found]
+        if rest:
+            with self.store_lock:
+                found.update(self.store.contains_many(rest))
+
+        return found
+
+    def add_many(self, memes):
+        with self.lock:
+            for link, source in memes:
+                self.journal.write(json.dumps([link, source]) + '\n')
+                self.pending[link] = source
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+            if len(self.pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self):
+        '''
+        Writes every journaled meme to the wrapped store. Returns the number of
+        memes written; on failure they stay journaled for the next attempt
+        '''
+        with self.lock:
+            batch = list(self.pending.items())
+        if not batch:
+            return 0
+
+        try:
+            with self.store_lock:
+                # A crash between the INSERT and the journal rewrite replays
+                # memes that already made it, so skip those
+                known = self.store.contains_many([link for link, _ in batch])
+                self.store.add_many([(link, source) for link, source in batch
+                                     if link not in known])
+        except Exception:  # pylint: disable=W0703
+            log = "Caught exception flushing {0} memes, will retry"
+            self.logger.exception(log.format(len(batch)))
+            return 0
+
+        with self.lock:
+            for link, _ in batch:
+                self.pending.pop(link, None)
+            self._rewrite_journal()
+
+        return len(batch)
+
+    def prune(self, before, archive=False):
+        # Flush first, so nothing journaled is left for the pruned range
+        self.flush()
+        with self.store_lock:
+            return self.store.prune(before, archive)
+
+    def compact(self):
+        with self.store_lock:
+            self.store.compact()
+
+    def close(self):
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+        with self.lock:
+            self.journal.close()
+
+        if self.pending:
+            log = "{0} memes left in journal {1}, they will be replayed on next start"
+            self.logger.warning(log.format(len(self.pending), self.journal_path))
+        else:
+            _remove(self.journal_path)
+            _remove(self.journal_path + '.lock')
+        self._lock_file.close()
+
+        self.store.close()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    @staticmethod
+    def _try_lock(path):
+        """ Returns the locked lock file for journal path, or None if a live
+            process holds it
+        """
+        lock_file = open(path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+
+        return lock_file
+
+    def _adopt_orphans(self):
+        """ Replays every journal whose process is gone. Returns {path: lock file}
+            for those journals, still locked
+        """
+        adopted = dict()
+
+        # The bare path is where journals went before they were per process
+        paths = [self.journal_base] + glob.glob(glob.escape(self.journal_base) + '.*')
+        for path in paths:
+            if path == self.journal_path or path.endswith(('.lock', '.tmp')):
+                continue
+            if not os.path.exists(path):
+                continue
+
+            lock_file = self._try_lock(path)
+            if lock_file is not None:
+                adopted[path] = lock_file
+                self._replay(path)
+
+        return adopted
+
+    def _replay(self, path):
+        if not os.path.exists(path):
+            return
+
+        replayed = 0
+        with open(path, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    link, source = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash mid-append; nothing after it is complete
+                    break
+                self.pending[link] = source
+                replayed += 1
+
+        if replayed:
+            log = "Replaying {0} memes from journal {1}"
+            self.logger.info(log.format(replayed, path))
+
+    def _rewrite_journal(self):
+        """ Replace the journal with just the memes still pending. Caller holds lock
+        """
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as tmp:
+            for link, source in self.pending.items():
+                tmp.write(json.dumps([link, source]) + '\n')
+            tmp.flush()
+            os.fsync(tmp.fileno())
+
+        if self.journal is not None:
+            self.journal.close()
+        os.replace(tmp_path, self.journal_path)
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        # Another process adopting the same orphan got there first
+        pass
@@ -0,0 +1,192 @@
+import time
+import socket
+import hashlib
+from bisect import bisect
+
+from chirplib.storage import SQLStore
+
+DEFAULT_SHARDS = 64
+DEFAULT_LEASE_TTL = 600
+
+# Points per node on the hash ring; more points, more even spread
+VNODES = 64
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+def default_worker_id():
+    # Stable across runs, so a one-shot worker on the next cron tick renews the
+    # leases its predecessor took rather than joining as a stranger
+    return socket.gethostname()
+
+
+class HashRing(object):
+    """ Consistent hash ring. Adding or removing a node only moves the keys
+        that node gains or loses
+    """
+    def __init__(self, nodes, vnodes=VNODES):
+        self.ring = sorted((_hash("{0}#{1}".format(node, i)), node)
+                           for node in nodes for i in range(vnodes))
+        self._points = [point for point, _ in self.ring]
+
+    def node_for(self, key):
+        if not self.ring:
+            raise ValueError("Hash ring has no nodes")
+
+        index = bisect(self._points, _hash(str(key))) % len(self.ring)
+        return self.ring[index][1]
+
+
+class ShardCoordinator(object):
+    """ Splits subreddits between harvesting workers through leases in the
+        shared database
+
+        Subreddits map to a fixed set of shards on one hash ring. Live workers,
+        found through heartbeats, map shards to workers on a second ring. Each
+        worker gives up leases on shards the ring moved away from it and leases
+        the ones it moved in, once their old owner released them or let them
+        expire. Workers can come and go without reconfiguring the others
+
+        Each worker's host is recorded with its heartbeat, so callers keeping
+        per-host state can tell when workers span hosts
+    """
+    def __init__(self, store, worker_id=None, shards=DEFAULT_SHARDS, ttl=DEFAULT_LEASE_TTL):
+        if not isinstance(store, SQLStore):
+            raise ValueError("Sharding needs a shared mysql or sqlite store")
+
+        self.worker_id = worker_id or default_worker_id()
+        self.host = socket.gethostname()
+        self.shards = shards
+        self.ttl = ttl
+        self.held = set()
+
+        self.placeholder = store.placeholder
+        self._shard_ring = HashRing(range(shards))
+
+        # Our own connection, so leases never contend with the store's users
+        self.con = store._connect()  # pylint: disable=protected-access
+        self._execute("""CREATE TABLE IF NOT EXISTS shard_leases
+                         (shard INTEGER PRIMARY KEY,
+                          owner VARCHAR(255),
+                          expires DOUBLE)
+                      """)
+        self._execute("""CREATE TABLE IF NOT EXISTS chirp_workers
+                         (worker VARCHAR(255) PRIMARY KEY,
+                          host VARCHAR(255),
+                          heartbeat DOUBLE)
+                      """)
+
+    def shard_for(self, subreddit):
+        return self._shard_ring.node_for(subreddit.lower())
+
+    def subreddits_for(self, subreddits):
+        '''
+        Filters subreddits down to those in shards this worker holds
+        '''
+        return [sub for sub in subreddits if self.shard_for(sub) in self.held]
+
+    def rebalance(self):
+        '''
+        Heartbeats, then releases and claims leases to match the current set of
+        live workers. Returns the shards this worker now holds
+        '''
+        now = time.time()
+        self._heartbeat(now)
+
+        workers = self.live_workers(now)
+        worker_ring = HashRing(workers)
+        wanted = {shard for shard in range(self.shards)
+                  if worker_ring.node_for(shard) == self.worker_id}
+
+        # Leases from an earlier run under our id count as held too
+        for shard in (self.held | self._owned()) - wanted:
+            self._release(shard)
+
+        self.held = {shard for shard in wanted if self._claim(shard, now)}
+
+        return self.held
+
+    def live_workers(self, now=None):
+        now = now or time.time()
+        rows = self._execute("SELECT worker FROM chirp_workers WHERE heartbeat > ?",
+                             (now - self.ttl, ), fetch=True)
+        workers = {row[0] for row in rows}
+        workers.add(self.worker_id)
+
+        return sorted(workers)
+
+    def live_hosts(self, now=None):
+        now = now or time.time()
+        rows = self._execute("SELECT host FROM chirp_workers WHERE heartbeat > ?",
+                             (now - self.ttl, ), fetch=True)
+        hosts = {row[0] for row in rows}
+        hosts.add(self.host)
+
+        return sorted(hosts)
+
+    def leave(self):
+        '''
+        Releases every lease and drops out of the worker set, so the remaining
+        workers pick up our shards without waiting for the leases to expire
+        '''
+        for shard in self.held:
+            self._release(shard)
+        self.held = set()
+
+        self._execute("DELETE FROM chirp_workers WHERE worker = ?", (self.worker_id, ))
+        self.con.close()
+
+    def _owned(self):
+        rows = self._execute("SELECT shard FROM shard_leases WHERE owner = ?",
+                             (self.worker_id, ), fetch=True)
+        return {row[0] for row in rows}
+
+    def _heartbeat(self, now):
+        updated = self._execute("""UPDATE chirp_workers SET host = ?, heartbeat = ?
+                                   WHERE worker = ?
+                                """, (self.host, now, self.worker_id))
+        if not updated:
+            self._insert("INSERT INTO chirp_workers (worker, host, heartbeat) VALUES (?, ?, ?)",
+                         (self.worker_id, self.host, now))
+
+    def _claim(self, shard, now):
+        """ Takes or renews the lease on shard if it's ours, free, or expired
+        """
+        claimed = self._execute("""UPDATE shard_leases SET owner = ?, expires = ?
+                                   WHERE shard = ?
+                                   AND (owner = ? OR owner IS NULL OR expires < ?)
+                                """, (self.worker_id, now + self.ttl, shard,
+                                      self.worker_id, now))
+        if claimed:
+            return True
+
+        return self._insert("INSERT INTO shard_leases (shard, owner, expires) VALUES (?, ?, ?)",
+                            (shard, self.worker_id, now + self.ttl))
+
+    def _release(self, shard):
+        self._execute("UPDATE shard_leases SET owner = NULL WHERE shard = ? AND owner = ?",
+                      (shard, self.worker_id))
+
+    def _insert(self, query, params):
+        """ Returns False if the row already exists, i.e. someone else has it
+        """
+        try:
+            self._execute(query, params)
+        except self.con.IntegrityError:
+            self.con.rollback()
+            return False
+
+        return True
+
+    def _execute(self, query, params=(), fetch=False):
+        cur = self.con.cursor()
+        try:
+            cur.execute(query.replace('?', self.placeholder), params)
+            result = cur.fetchall() if fetch else cur.rowcount
+        finally:
+            cur.close()
+        self.con.commit()
+
+        return result
@@ -0,0 +1,374 @@
+import sqlite3
+from datetime import date, datetime as dt
+
+# Keep IN (...) lists well under SQLite's default limit of 999 bound parameters
+CHUNK_SIZE = 500
+
+BACKENDS = ('mysql', 'sqlite', 'memory')
+
+# Monthly partitions kept ready past the current month, so inserts never land
+# in the catch-all partition
+PARTITIONS_AHEAD = 3
+
+# MySQL client errors for a dropped connection: server gone away, lost
+# connection during query
+LOST_CONNECTION = (2006, 2013)
+
+
+def _month(day):
+    return date(day.year, day.month, 1)
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _months(first, last):
+    '''
+    First days of every month from first's through last's
+    '''
+    month = _month(first)
+    while month <= last:
+        yield month
+        month = _next_month(month)
+
+
+class MemeStore(object):
+    """ Base class for the collection of memes that have already been posted
+
+        Subclasses must implement contains_many and add_many; the single-item
+        methods are built on top of them
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def contains(self, link):
+        '''
+        Checks to see if the supplied link is already in the collection
+        '''
+        return link in self.contains_many([link])
+
+    def contains_many(self, links):
+        '''
+        Returns the set of the supplied links that are already in the collection
+        '''
+        raise NotImplementedError
+
+    def add(self, link, source):
+        '''
+        Adds a link to the collection
+        '''
+        self.add_many([(link, source)])
+
+    def add_many(self, memes):
+        '''
+        Adds an iterable of (link, source) pairs to the collection
+        '''
+        raise NotImplementedError
+
+    def prune(self, before, archive=False):
+        '''
+        Drops memes added before the supplied datetime, or moves them to an
+        archive. Returns the number of memes pruned
+        '''
+        raise NotImplementedError
+
+    def compact(self):
+        '''
+        Reclaims the space pruned memes used and rebuilds the dedup index
+        '''
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryStore(MemeStore):
+    """ In-process store, for tests and dry runs. Nothing survives a restart
+    """
+    def __init__(self):
+        self.memes = dict()
+        self.archived = dict()
+
+    def contains_many(self, links):
+        return {link for link in links if link in self.memes}
+
+    def add_many(self, memes):
+        now = str(dt.now())
+        for link, source in memes:
+            self.memes[link] = (source, now)
+
+    def prune(self, before, archive=False):
+        old = [link for link, (_, created) in self.memes.items() if created < str(before)]
+        for link in old:
+            meme = self.memes.pop(link)
+            if archive:
+                self.archived[link] = meme
+
+        return len(old)
+
+
+class SQLStore(MemeStore):
+    """ Shared implementation for DB-API backed stores holding one open connection
+    """
+    placeholder = '?'
+
+    def __init__(self):
+        self.con = self._connect()
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def _execute(self, query, params=(), many=False):
+        cur = self.con.cursor()
+        try:
+            if many:
+                cur.executemany(query, params)
+            else:
+                cur.execute(query, params)
+            rows = cur.fetchall() if cur.description else None
+        finally:
+            cur.close()
+        self.con.commit()
+
+        return rows
+
+    def contains_many(self, links):
+        links = list(set(links))
+        found = set()
+
+        for start in range(0, len(links), CHUNK_SIZE):
+            chunk = links[start:start + CHUNK_SIZE]
+            query = "SELECT links FROM memes WHERE links IN ({0})".format(
+                ', '.join([self.placeholder] * len(chunk)))
+            found.update(row[0] for row in self._execute(query, chunk))
+
+        return found
+
+    def add_many(self, memes):
+        now = str(dt.now())
+        rows = [(link, source, now) for link, source in memes]
+        if not rows:
+            return
+
+        query = """INSERT INTO memes
+                   (links, sources, datecreated)
+                   VALUES
+                   ({0}, {0}, {0})
+                """.format(self.placeholder)
+        self._execute(query, rows, many=True)
+
+    def close(self):
+        self.con.close()
+
+
+class SQLiteStore(SQLStore):
+    """ Embedded store, for deployments without a MySQL server
+    """
+    def __init__(self, path):
+        self.path = path
+        super().__init__()
+
+    def _connect(self):
+        # WriteBehindStore flushes from its own thread, serialising access itself
+        con = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("""CREATE TABLE IF NOT EXISTS memes
+                       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        links TEXT NOT NULL,
+                        sources TEXT,
+                        datecreated TEXT)
+                    """)
+        con.execute("CREATE INDEX IF NOT EXISTS memes_links ON memes (links)")
+        con.execute("CREATE INDEX IF NOT EXISTS memes_datecreated ON memes (datecreated)")
+        con.commit()
+
+        return con
+
+    def prune(self, before, archive=False):
+        # No partitions in SQLite; the datecreated index keeps this a range scan
+        if archive:
+            self._execute("""CREATE TABLE IF NOT EXISTS memes_archive
+                             (id INTEGER PRIMARY KEY,
+                              links TEXT NOT NULL,
+                              sources TEXT,
+                              datecreated TEXT)
+                          """)
+
+        # Archive and delete in one transaction, so a crash can't leave rows
+        # in both tables; OR IGNORE covers archives from before that was so
+        with self.con:
+            if archive:
+                self.con.execute("""INSERT OR IGNORE INTO memes_archive
+                                    (id, links, sources, datecreated)
+                                    SELECT id, links, sources, datecreated FROM memes
+                                    WHERE datecreated < ?
+                                 """, (str(before), ))
+            cur = self.con.execute("DELETE FROM memes WHERE datecreated < ?", (str(before), ))
+
+        return cur.rowcount
+
+    def compact(self):
+        self._execute("REINDEX memes_links")
+        self._execute("VACUUM")
+
+
+class MySQLStore(SQLStore):
+    """ Store backed by the `memes` table in MySQL
+    """
+    placeholder = '%s'
+
+    def __init__(self, database, username, password, host='localhost', connect_timeout=10,
+                 read_timeout=30):
+        self.database = database
+        self.username = username
+        self.password = password
+        self.host = host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        super().__init__()
+
+    def _connect(self):
+        import MySQLdb as mdb  # pylint: disable=import-outside-toplevel
+
+        return mdb.connect(self.host, self.username, self.password, self.database,
+                           charset='utf8', connect_timeout=self.connect_timeout,
+                           read_timeout=self.read_timeout)
+
+    def _execute(self, query, params=(), many=False):
+        import MySQLdb as mdb  # pylint: disable=import-outside-toplevel
+
+        try:
+            return super()._execute(query, params, many)
+        except mdb.OperationalError as exc:
+            if exc.args[0] not in LOST_CONNECTION:
+                raise
+
+        # The server drops idle connections; reconnect once and retry
+        try:
+            self.con.close()
+        except mdb.Error:
+            pass
+        self.con = self._connect()
+        return super()._execute(query, params, many)
+
+    def partitions(self):
+        '''
+        Returns the names of memes' monthly partitions, oldest first, without
+        the catch-all pmax
+        '''
+        rows = self._execute("""SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+                                WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'memes'
+                                AND PARTITION_NAME IS NOT NULL
+                             """, (self.database, ))
+
+        return sorted(row[0] for row in rows if row[0] != 'pmax')
+
+    def partition(self, ahead=PARTITIONS_AHEAD):
+        '''
+        Range-partitions memes by month of datecreated, or adds the months
+        needed to keep partitions ahead months past the current one
+        '''
+        last = date.today()
+        for _ in range(ahead):
+            last = _next_month(_month(last))
+
+        existing = self.partitions()
+        if existing:
+            first = _next_month(self._partition_month(existing[-1]))
+        else:
+            oldest = self._execute("SELECT MIN(datecreated) FROM memes")[0][0]
+            first = oldest or date.today()
+
+        months = ["PARTITION p{0:%Y%m} VALUES LESS THAN (TO_DAYS('{1}'))".format(
+            month, _next_month(month)) for month in _months(first, last)]
+        months.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+
+        if existing:
+            if len(months) > 1:
+                self._execute("ALTER TABLE memes REORGANIZE PARTITION pmax INTO ({0})".format(
+                    ', '.join(months)))
+            return
+
+        # MySQL requires the partitioning column in every unique key
+        unique = dict()
+        for row in self._execute("SHOW KEYS FROM memes"):
+            # (table, non_unique, key_name, seq_in_index, column_name, ...)
+            if not row[1]:
+                unique.setdefault(row[2], []).append(row[4])
+
+        others = sorted(name for name, columns in unique.items()
+                        if name != 'PRIMARY' and 'datecreated' not in columns)
+        if others:
+            # Adding datecreated would quietly stop them enforcing uniqueness
+            exc_str = ("Can't partition memes while unique keys {0} leave out datecreated. "
+                       "Replace them with plain indexes first")
+            raise ValueError(exc_str.format(', '.join(others)))
+
+        primary = unique.get('PRIMARY')
+        if primary and 'datecreated' not in primary:
+            self._execute("ALTER TABLE memes DROP PRIMARY KEY, ADD PRIMARY KEY ({0})".format(
+                ', '.join(primary + ['datecreated'])))
+
+        self._execute("ALTER TABLE memes PARTITION BY RANGE (TO_DAYS(datecreated)) ({0})".format(
+            ', '.join(months)))
+
+    def prune(self, before, archive=False):
+        '''
+        Drops whole monthly partitions older than before, so up to a month more
+        than asked for is kept. Archived partitions become memes_archive_YYYYMM
+        tables
+        '''
+        self.partition()
+
+        pruned = 0
+        for name in self.partitions():
+            if _next_month(self._partition_month(name)) > before.date():
+                break
+
+            pruned += self._execute("SELECT COUNT(*) FROM memes PARTITION ({0})".format(
+                name))[0][0]
+            if archive:
+                table = "memes_archive_{0}".format(name[1:])
+                self._execute("CREATE TABLE {0} LIKE memes".format(table))
+                self._execute("ALTER TABLE {0} REMOVE PARTITIONING".format(table))
+                self._execute("ALTER TABLE memes EXCHANGE PARTITION {0} WITH TABLE {1}".format(
+                    name, table))
+            self._execute("ALTER TABLE memes DROP PARTITION {0}".format(name))
+
+        return pruned
+
+    def compact(self):
+        # InnoDB rebuilds the table and its indexes, then re-analyzes
+        self._execute("OPTIMIZE TABLE memes")
+
+    @staticmethod
+    def _partition_month(name):
+        return dt.strptime(name, 'p%Y%m').date()
+
+
+def get_store(config):
+    """
+    Builds the meme store selected by the [storage] section of chirp.ini
+
+    :param config: ConfigParser holding the Chirp configuration
+    """
+    backend = config.get('storage', 'backend', fallback='mysql')
+
+    if backend == 'mysql':
+        return MySQLStore(config['mysql']['database'],
+                          config['mysql']['username'],
+                          config['mysql']['password'],
+                          host=config.get('mysql', 'host', fallback='localhost'),
+                          connect_timeout=config.getint('mysql', 'connect_timeout', fallback=10),
+                          read_timeout=config.getint('mysql', 'read_timeout', fallback=30))
+    elif backend == 'sqlite':
+        return SQLiteStore(config.get('storage', 'path', fallback='/var/lib/chirp/memes.db'))
+    elif backend == 'memory':
+        return MemoryStore()
+    else:
+        exc_str = "Storage backend not recognized: {0}. Expected one of: {1}"
+        raise ValueError(exc_str.format(backend, ', '.join(BACKENDS)))
@@ -0,0 +1,87 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) in seconds
+DEFAULT_TIMEOUT = (3.05, 30)
+
+
+class TimeoutSession(requests.Session):
+    """ requests.Session that applies a default timeout to every request, capped
+        by the run budget when one is set
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, budget=None):
+        super().__init__()
+        self.timeout = timeout
+        self.budget = budget
+
+    def request(self, method, url, **kwargs):  # pylint: disable=arguments-differ
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().request(method, url, **kwargs)
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        # Capped here rather than in request(), as praw sends prepared requests
+        if self.budget is not None and kwargs.get('timeout') is not None:
+            kwargs['timeout'] = self.budget.cap(kwargs['timeout'])
+        return super().send(request, **kwargs)
+
+
+class Transport(object):
+    """ The one pooled HTTP session Chirp makes outbound requests through
+    """
+    def __init__(self, pool_hosts=10, pool_size=4, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+
+        # pool_block makes pool_size a hard per-host limit, rather than opening
+        # throwaway connections once the pool is exhausted
+        self.adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size,
+                                   pool_block=True)
+
+        self.session = TimeoutSession(timeout)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Builds a Transport from the [transport] section of chirp.ini
+
+        :param config: ConfigParser holding the Chirp configuration
+        """
+        timeout = (config.getfloat('transport', 'connect_timeout', fallback=DEFAULT_TIMEOUT[0]),
+                   config.getfloat('transport', 'read_timeout', fallback=DEFAULT_TIMEOUT[1]))
+
+        return cls(pool_hosts=config.getint('transport', 'pool_hosts', fallback=10),
+                   pool_size=config.getint('transport', 'pool_size', fallback=4),
+                   timeout=timeout)
+
+    def stats(self):
+        '''
+        Returns {host: (connections opened, requests made)} for every pooled host
+        '''
+        pools = self.adapter.poolmanager.pools
+        stats = dict()
+
+        for key in list(pools.keys()):
+            try:
+                pool = pools[key]
+            except KeyError:
+                # Evicted while we were looking
+                continue
+            stats[pool.host] = (pool.num_connections, pool.num_requests)
+
+        return stats
+
+    def format_stats(self):
+        """ One line per host, for the log
+        """
+        lines = list()
+        for host, (connections, reqs) in sorted(self.stats().items()):
+            line = "{0}: {1} requests over {2} connections ({3} reused)"
+            lines.append(line.format(host, reqs, connections, max(0, reqs - connections)))
+
+        return "\n\t".join(lines) or "no requests made"
+
+    def close(self):
+        self.session.close()
@@ -25,4 +25,7 @@ setup(
         'retryz',
         'requests',
     ],
+    extras_require={
+        'media': ['Pillow'],
+    },
 )
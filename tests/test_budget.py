@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+from chirplib.budget import BudgetExceeded, RunBudget, STAGE_SHARES
+from chirplib.transport import Transport
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_unbounded():
+    """ Verify a budget without a deadline never cuts anything short
+    """
+    budget = RunBudget()
+
+    assert budget.timeout('reddit') is None
+    assert budget.cap((3, 30)) == (3, 30)
+    assert budget.run('reddit', lambda x: x * 2, 21) == 42
+    assert not budget.expired
+    assert "reddit: " in budget.report()
+    assert "no deadline" in budget.report()
+
+
+def test_stage_slices():
+    """ Verify each stage gets its share of what's left, and nothing once spent
+    """
+    clock = FakeClock()
+    budget = RunBudget(100, clock=clock)
+
+    assert budget.timeout('reddit') == 100 * STAGE_SHARES['reddit']
+
+    clock.now = 60
+    assert budget.timeout('twitter') == 40
+    assert budget.cap((3.05, 30)) == (3.05, 30)
+
+    clock.now = 98
+    assert budget.cap((3.05, 30)) == (2, 2)
+
+    clock.now = 100
+    assert budget.expired
+    with pytest.raises(BudgetExceeded):
+        budget.timeout('dedup')
+
+
+def test_straggler_abandoned():
+    """ Verify a call overrunning its slice is abandoned and reported
+    """
+    budget = RunBudget(0.2)
+
+    with pytest.raises(BudgetExceeded):
+        budget.run('reddit', time.sleep, 5)
+
+    # Errors from calls that finish in time come through unchanged
+    with pytest.raises(KeyError):
+        budget.run('imgur', {}.__getitem__, 'missing')
+
+    assert budget.stages['reddit'][1:] == [1, 1]
+    assert "(1 abandoned)" in budget.report()
+
+
+def test_restart():
+    """ Verify restarting starts a fresh budget with a clean report
+    """
+    clock = FakeClock()
+    budget = RunBudget(10, clock=clock)
+    with budget.track('dedup'):
+        clock.now = 20
+
+    assert budget.expired
+    assert budget.stages['dedup'] == [20, 1, 0]
+
+    budget.restart()
+
+    assert not budget.expired
+    assert not budget.stages
+
+
+def test_session_timeouts_capped():
+    """ Verify the pooled session never waits past the end of the budget
+    """
+    clock = FakeClock()
+    transport = Transport(timeout=(3.05, 30))
+    transport.session.budget = RunBudget(10, clock=clock)
+    clock.now = 9
+    seen = dict()
+
+    def fake_send(request, **kwargs):
+        seen.update(kwargs)
+        raise RuntimeError("stop before touching the network")
+
+    transport.adapter.send = fake_send
+
+    with pytest.raises(RuntimeError):
+        transport.session.get("http://example.com/")
+
+    assert seen['timeout'] == (1, 1)
@@ -0,0 +1,77 @@
+import time
+
+from chirplib.candidates import CandidateQueue
+from chirplib.memes import DankMeme, ImgurMeme
+
+
+def test_push_and_pop(tmpdir):
+    """ Tests a meme makes the round trip through the queue
+    """
+    path = str(tmpdir.join("candidates.db"))
+
+    with CandidateQueue(path) as queue:
+        meme = DankMeme("test dank link", "test dank source")
+
+        assert queue.push(meme)
+        assert not queue.push(meme)
+        assert meme in queue
+        assert len(queue) == 1
+
+        popped = queue.pop()
+
+        assert isinstance(popped, DankMeme)
+        assert popped.link == meme.link
+        assert popped.source == meme.source
+        assert len(queue) == 0
+        assert queue.pop() is None
+
+
+def test_digested_state_survives(tmpdir):
+    """ Verify a digested ImgurMeme comes back out of the queue still digested
+    """
+    path = str(tmpdir.join("candidates.db"))
+
+    meme = ImgurMeme("http://imgur.com/a/albumid1", "test imgur source")
+    meme.link_type = ImgurMeme.ALBUM_LINK
+    meme.image_count = 3
+    meme.first_image_link = "http://i.imgur.com/first.jpg"
+    meme._digested = True
+
+    with CandidateQueue(path) as queue:
+        queue.push(meme)
+
+    with CandidateQueue(path) as queue:
+        popped = queue.pop()
+
+    assert isinstance(popped, ImgurMeme)
+    assert popped.format_for_twitter() == meme.format_for_twitter()
+
+
+def test_expired_candidates_dropped(tmpdir):
+    """ Verify candidates past their expiry are never handed out
+    """
+    path = str(tmpdir.join("candidates.db"))
+
+    with CandidateQueue(path) as queue:
+        queue.push(DankMeme("stale link", "test source"), ttl=-1)
+        queue.push(DankMeme("fresh link", "test source"), ttl=60)
+
+        assert len(queue) == 1
+        assert queue.pop().link == "fresh link"
+        assert queue.pop() is None
+        assert queue.con.execute("SELECT COUNT(*) FROM candidates").fetchone()[0] == 0
+
+
+def test_expired_slot_can_be_refilled(tmpdir):
+    """ Verify a link whose candidate expired can be queued again after a purge
+    """
+    path = str(tmpdir.join("candidates.db"))
+
+    with CandidateQueue(path) as queue:
+        meme = DankMeme("test link", "test source")
+        queue.push(meme, ttl=-1)
+        time.sleep(0.01)
+
+        assert meme not in queue
+        assert queue.purge_expired() == 1
+        assert queue.push(meme)
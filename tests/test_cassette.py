@@ -0,0 +1,167 @@
+import os
+import threading
+from configparser import ConfigParser
+from types import SimpleNamespace
+
+import pytest
+import requests
+from twitter import TwitterError
+
+from chirplib.cassette import (Cassette,
+                               CassetteMissError,
+                               CassetteReddit,
+                               CassetteSession,
+                               CassetteStore,
+                               CassetteTwitter,
+                               RECORD,
+                               REPLAY)
+from chirplib.cli import get_cassette, parse_args
+from chirplib.storage import MemoryStore
+
+
+class FakeReddit(object):
+    def get_subreddit(self, subreddit):
+        listing = [SimpleNamespace(url="http://i.imgur.com/{0}{1}.jpg".format(subreddit, i),
+                                   title="title {0}".format(i), over_18=False,
+                                   fullname="t3_{0}{1}".format(subreddit, i))
+                   for i in range(3)]
+        return SimpleNamespace(get_hot=lambda **kwargs: iter(listing))
+
+
+class FakeApi(object):
+    def PostUpdate(self, status, media=None):  # pylint: disable=invalid-name
+        if 'fail' in status:
+            raise TwitterError("duplicate status")
+        return SimpleNamespace(AsDict=lambda: {'id': 1, 'text': status})
+
+
+def _fail_factory():
+    raise AssertionError("replay must not build real clients")
+
+
+def test_record_then_replay(tmpdir):
+    """ Verify every recorded call is answered identically on replay
+    """
+    path = str(tmpdir.join("run.cassette.gz"))
+
+    tape = Cassette(path, RECORD)
+    reddit = CassetteReddit(tape, FakeReddit)
+    api = CassetteTwitter(tape, FakeApi)
+    backend = MemoryStore()
+    backend.add("http://i.imgur.com/dank0.jpg", "dank")
+    store = CassetteStore(tape, backend)
+
+    recorded = [(s.url, s.title) for s in reddit.get_subreddit("dank").get_hot()]
+    found = store.contains_many(["http://i.imgur.com/dank0.jpg", "http://i.imgur.com/dank1.jpg"])
+    posted = api.PostUpdate("hello", media="http://i.imgur.com/dank1.jpg")
+    with pytest.raises(TwitterError):
+        api.PostUpdate("fail")
+    tape.close()
+
+    tape = Cassette(path, REPLAY, speedup=0)
+    reddit = CassetteReddit(tape, _fail_factory)
+    api = CassetteTwitter(tape, _fail_factory)
+    store = CassetteStore(tape, MemoryStore())
+
+    assert [(s.url, s.title) for s in reddit.get_subreddit("dank").get_hot()] == recorded
+    assert store.contains_many(["http://i.imgur.com/dank0.jpg",
+                                "http://i.imgur.com/dank1.jpg"]) == found
+    assert api.PostUpdate("hello").text == posted.AsDict()['text']
+    with pytest.raises(TwitterError) as excstr:
+        api.PostUpdate("fail")
+    assert "duplicate status" in str(excstr.value)
+
+
+def test_replay_clones_subreddits(tmpdir):
+    """ Verify cloned subreddits replay the original listing with distinct links
+    """
+    path = str(tmpdir.join("run.cassette.gz"))
+
+    tape = Cassette(path, RECORD)
+    list(CassetteReddit(tape, FakeReddit).get_subreddit("dank").get_hot())
+    tape.close()
+
+    tape = Cassette(path, REPLAY, speedup=0)
+    chirp = SimpleNamespace(transport=SimpleNamespace(session=None), media=None, giphy=None,
+                            subreddits=["dank"], store=MemoryStore(),
+                            _connect_reddit=_fail_factory, _connect_twitter=_fail_factory)
+    tape.install(chirp, multiply=3)
+
+    assert chirp.subreddits == ["dank", "dank~1", "dank~2"]
+
+    urls = [s.url for sub in chirp.subreddits for s in chirp._reddit.get_subreddit(sub).get_hot()]
+
+    assert len(urls) == 9
+    assert len(set(urls)) == 9
+    assert "http://i.imgur.com/dank0.jpg#2" in urls
+
+
+def test_http_fallback_and_miss(tmpdir):
+    """ Verify unseen URLs reuse recordings of the same kind, and unknown kinds miss
+    """
+    path = str(tmpdir.join("run.cassette.gz"))
+    response = SimpleNamespace(status_code=200, headers={'Content-Type': 'image/png'},
+                               content=b'\x89PNG')
+
+    tape = Cassette(path, RECORD)
+    CassetteSession(tape, SimpleNamespace(get=lambda url, **kwargs: response)).get("http://a/1")
+    tape.close()
+
+    tape = Cassette(path, REPLAY, speedup=0)
+    session = CassetteSession(tape, None)
+
+    resp = session.get("http://a/2")
+    assert resp.content == b'\x89PNG'
+    assert resp.headers['Content-Type'] == 'image/png'
+
+    with pytest.raises(CassetteMissError):
+        tape.call('imgur.get_image', 'abc', None)
+
+    # Giphy metadata is never answered with someone else's
+    with pytest.raises(requests.ConnectionError):
+        session.get("https://api.giphy.com/v1/gifs/abc")
+
+
+def test_replay_keeps_state_out_of_production(tmpdir):
+    """ Verify a replay's queue and caches live in a scratch directory that
+        goes away with the cassette
+    """
+    path = str(tmpdir.join("run.cassette.gz"))
+    Cassette(path, RECORD).close()
+
+    config = ConfigParser()
+    config.read_dict({'queue': {'path': '/var/lib/chirp/candidates.db'},
+                      'giphy': {'api_key': 'key', 'cache': '/var/lib/chirp/giphy.db'}})
+    tape = get_cassette(parse_args(['--replay', path, 'harvest']), config)
+
+    for section, option in (('queue', 'path'), ('giphy', 'cache'), ('media', 'cache_dir')):
+        assert config[section][option].startswith(tape.scratch_dir)
+    assert config['giphy']['api_key'] == 'key'
+    assert config['storage']['backend'] == 'memory'
+
+    tape.close()
+
+    assert not os.path.exists(tape.scratch_dir)
+
+
+def test_concurrent_writes_stay_whole(tmpdir):
+    """ Verify lines recorded from several threads at once never interleave
+    """
+    path = str(tmpdir.join("run.cassette.gz"))
+    tape = Cassette(path, RECORD)
+    value = {'return': 'x' * 10000}
+
+    def record(thread):
+        for index in range(50):
+            tape.write('http.get', "{0}/{1}".format(thread, index), 0.0, value)
+
+    threads = [threading.Thread(target=record, args=(thread, )) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    tape.close()
+
+    tape = Cassette(path, REPLAY, speedup=0)
+
+    assert len(tape.by_kind['http.get']) == 200
@@ -0,0 +1,254 @@
+import logging
+from configparser import ConfigParser
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from twitter import TwitterError
+
+from chirplib.candidates import CandidateQueue
+from chirplib.chirp import Chirp
+from chirplib.memes import DankMeme, Meme, RedditUploadsMeme
+from chirplib.sharding import ShardCoordinator
+from chirplib.storage import SQLiteStore
+
+
+class PagedReddit(object):
+    """ Hot listing of 100 memes, served a page at a time
+    """
+    def __init__(self):
+        self.pages = 0
+        self.listing = [SimpleNamespace(url="http://i.example.com/{0}.jpg".format(i),
+                                        title="meme {0}".format(i), over_18=False,
+                                        fullname="t3_{0}".format(i))
+                        for i in range(100)]
+
+    def get_subreddit(self, subreddit):
+        if subreddit == "slow":
+            return SimpleNamespace(get_hot=self.time_out)
+        return SimpleNamespace(get_hot=self.get_hot)
+
+    @staticmethod
+    def time_out(**kwargs):
+        raise requests.exceptions.ReadTimeout("read timed out")
+
+    def get_hot(self, limit=25, params=None):
+        self.pages += 1
+        start = 0
+        if params and params.get('after'):
+            start = int(params['after'][3:]) + 1
+        return iter(self.listing[start:start + limit])
+
+
+@pytest.fixture
+def chirp(tmpdir):
+    config = ConfigParser()
+    config.read_dict({
+        'twitter': {},
+        'reddit': {'subreddits': 'dankmemes', 'stream': 'true', 'page_size': '10',
+                   'max_pages': '10', 'dedup_batch': '5', 'buffer': '3'},
+        'imgur': {'client_id': '', 'client_secret': ''},
+        'storage': {'backend': 'memory'},
+        'misc': {'include_nsfw': 'false', 'max_memes': '1'},
+        'queue': {'path': str(tmpdir.join("candidates.db")), 'size': '5'},
+    })
+
+    bot = Chirp(config, logging.getLogger('chirp-test'))
+    bot._reddit = PagedReddit()
+
+    yield bot
+
+    bot.close()
+
+
+def test_stream_stops_early(chirp):
+    """ Verify streaming stops paging once enough fresh memes are buffered
+    """
+    # The first 23 memes were posted before
+    chirp.store.add_many(("http://i.example.com/{0}.jpg".format(i), 'dankmemes')
+                         for i in range(23))
+
+    meme = next(chirp._meme_gen())
+
+    assert meme.link in {"http://i.example.com/{0}.jpg".format(i) for i in range(23, 30)}
+    assert chirp._reddit.pages == 3
+    assert chirp.listing_pages == 3
+    assert chirp.listing_memes == 30
+
+
+def test_stream_exhausts_listing(chirp):
+    """ Verify streaming still offers every fresh meme, up to max_pages
+    """
+    links = [meme.link for meme in chirp._meme_gen()]
+
+    assert len(links) == len(set(links)) == 100
+    assert chirp.listing_pages == 10
+
+
+def test_eager_listing(chirp):
+    """ Verify the whole first page is fetched at once without streaming
+    """
+    chirp.stream_listings = False
+
+    links = [meme.link for meme in chirp._meme_gen()]
+
+    assert len(links) == 25
+    assert chirp.listing_pages == 1
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_slow_subreddit_skipped(chirp, stream):
+    """ Verify a subreddit that times out is skipped rather than ending the run
+    """
+    chirp.stream_listings = stream
+    chirp.subreddits = ["slow", "dankmemes"]
+
+    links = [meme.link for meme in chirp._meme_gen()]
+
+    assert len(links) == (100 if stream else 25)
+
+
+def test_maintain(chirp):
+    """ Verify memes older than the dedup window are pruned and can be posted again
+    """
+    chirp.store.add("http://i.example.com/0.jpg", 'dankmemes')
+    chirp.store.memes["http://i.example.com/0.jpg"] = ('dankmemes', '2020-01-15 00:00:00')
+    chirp.store.add("http://i.example.com/1.jpg", 'dankmemes')
+
+    assert chirp.maintain() == 1
+    assert chirp.store.contains_many(["http://i.example.com/0.jpg",
+                                      "http://i.example.com/1.jpg"]) == {
+                                          "http://i.example.com/1.jpg"}
+    assert "http://i.example.com/0.jpg" in chirp.store.archived
+
+
+def test_media_downloaded_through_session(chirp):
+    """ Verify remote media reaches PostUpdate as a file fetched through our
+        session, never as a URL for python-twitter to fetch itself
+    """
+    uploads = list()
+
+    def post_update(status, media=None):
+        uploads.append((media.name, media.mode, media.read()))
+
+    session = SimpleNamespace(get=lambda url: SimpleNamespace(
+        content=b'GIF89a', raise_for_status=lambda: None))
+    chirp._api = SimpleNamespace(PostUpdate=post_update)
+
+    with patch.object(Meme, 'session', session):
+        assert chirp.post_to_twitter(DankMeme("http://i.example.com/0.gif", 'dankmemes'))
+
+    assert uploads[0][0].endswith('.gif')
+    assert uploads[0][1:] == ('rb+', b'GIF89a')
+    assert chirp.store.contains("http://i.example.com/0.gif")
+
+
+class FakeTwitter(object):
+    """ Records posted statuses, failing the first `failures` attempts
+    """
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.posted = list()
+
+    def PostUpdate(self, status, media=None):  # pylint: disable=invalid-name
+        if self.failures:
+            self.failures -= 1
+            raise TwitterError("over capacity")
+        self.posted.append(media.name)
+
+
+@pytest.fixture
+def twitter(chirp):
+    """ Stands in for Twitter, and for the media downloads before posting
+    """
+    session = SimpleNamespace(get=lambda url: SimpleNamespace(
+        content=b'\xff\xd8', raise_for_status=lambda: None))
+    chirp._api = FakeTwitter()
+
+    with patch.object(Meme, 'session', session):
+        yield chirp._api
+
+
+def test_harvest_shards_refuses_other_hosts(chirp, tmpdir):
+    """ Verify a worker won't fill its local queue while workers on other hosts
+        are live, as their candidates would never be merged
+    """
+    store = SQLiteStore(str(tmpdir.join("memes.db")))
+    remote = ShardCoordinator(store, worker_id="remote", shards=8)
+    remote.host = "elsewhere"
+    remote.rebalance()
+
+    chirp.shards = ShardCoordinator(store, worker_id="local", shards=8)
+    with pytest.raises(ValueError) as excstr:
+        chirp.harvest_shards()
+
+    assert "elsewhere" in str(excstr.value)
+    assert not chirp.shards.held
+    assert chirp._reddit.pages == 0
+
+    remote.leave()
+    chirp.leave_shards()
+    store.close()
+
+
+def test_harvest_fills_queue_to_size(chirp):
+    """ Verify harvest stops at the queue size, and a full queue fetches nothing
+    """
+    assert chirp.harvest() == 5
+    pages = chirp._reddit.pages
+
+    assert chirp.harvest() == 0
+    assert chirp._reddit.pages == pages
+
+    with CandidateQueue(chirp.queue_path) as queue:
+        assert len(queue) == 5
+
+
+def test_post_candidate_empty_queue(chirp, twitter):
+    assert not chirp.post_candidate()
+    assert not twitter.posted
+
+
+def test_post_candidate_requeues_after_failed_post(chirp, twitter):
+    """ Verify a candidate Twitter refuses stays queued for the next run
+    """
+    chirp.harvest()
+    twitter.failures = 1
+
+    assert not chirp.post_candidate()
+    assert not twitter.posted
+
+    with CandidateQueue(chirp.queue_path) as queue:
+        assert len(queue) == 5
+
+    assert chirp.post_candidate()
+    assert len(twitter.posted) == 1
+
+
+def test_post_candidate_skips_posted_elsewhere(chirp, twitter):
+    """ Verify a candidate posted by another run while queued isn't posted again
+    """
+    with CandidateQueue(chirp.queue_path) as queue:
+        queue.push(DankMeme("http://i.example.com/old.jpg", 'dankmemes'))
+        queue.push(DankMeme("http://i.example.com/new.jpg", 'dankmemes'))
+    chirp.store.add("http://i.example.com/old.jpg", 'dankmemes')
+
+    assert chirp.post_candidate()
+    assert chirp.store.contains("http://i.example.com/new.jpg")
+    assert len(twitter.posted) == 1
+    assert not chirp.post_candidate()
+
+
+def test_media_lookup_timeout_skips_meme(chirp, twitter):
+    """ Verify a meme whose media lookup times out is skipped, not the run ended
+    """
+    def time_out(url, **kwargs):
+        raise requests.exceptions.ReadTimeout("read timed out")
+
+    with patch.object(Meme, 'session', SimpleNamespace(get=time_out)):
+        meme = RedditUploadsMeme("https://i.reddituploads.com/abc?fit=max", 'dankmemes')
+        assert not chirp.post_to_twitter(meme)
+
+    assert not twitter.posted
@@ -1,2 +1,15 @@
+from chirplib.cli import parse_args
+
+
 def test_main():
     assert True
+
+
+def test_parse_args_default_command():
+    assert parse_args([]).command == 'run'
+
+
+def test_parse_args_subcommands():
+    assert parse_args(['harvest']).command == 'harvest'
+    assert parse_args(['post']).command == 'post'
+    assert parse_args(['maintain']).command == 'maintain'
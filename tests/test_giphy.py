@@ -0,0 +1,124 @@
+import pytest
+
+from chirplib.giphy import GiphyResolver, giphy_id, pick_rendition
+from chirplib.media import MediaTooLargeError
+from chirplib.memes import GiphyMeme
+
+MB = 1024 * 1024
+
+IMAGES = {
+    'original': {'url': 'https://media.giphy.com/media/abc/giphy.gif', 'size': str(20 * MB),
+                 'width': '480', 'height': '270',
+                 'mp4': 'https://media.giphy.com/media/abc/giphy.mp4', 'mp4_size': str(2 * MB)},
+    'downsized': {'url': 'https://media.giphy.com/media/abc/giphy-downsized.gif',
+                  'size': str(1 * MB), 'width': '250', 'height': '140'},
+    'downsized_small': {'mp4': 'https://media.giphy.com/media/abc/giphy-downsized-small.mp4',
+                        'mp4_size': str(MB // 2), 'width': '200', 'height': '112'},
+    'fixed_width_still': {'url': 'https://media.giphy.com/media/abc/200w_s.gif',
+                          'size': '9000', 'width': '200', 'height': '112'},
+}
+
+
+class FakeResponse(object):
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeSession(object):
+    def __init__(self, images):
+        self.images = images
+        self.calls = list()
+
+    def get(self, url, params=None):
+        self.calls.append((url, params))
+        return FakeResponse({'data': {'images': self.images}})
+
+
+@pytest.mark.parametrize("link", [
+    "http://giphy.com/gifs/funny-lol-gif-fJIZa8yIfiEFi",
+    "https://giphy.com/gifs/fJIZa8yIfiEFi",
+    "https://media.giphy.com/media/fJIZa8yIfiEFi/giphy.gif",
+    "https://i.giphy.com/fJIZa8yIfiEFi.gif",
+])
+def test_giphy_id(link):
+    assert giphy_id(link) == "fJIZa8yIfiEFi"
+
+
+def test_pick_smallest_that_fits():
+    """ Verify the smallest postable rendition wins, and stills are never picked
+    """
+    picked = pick_rendition(IMAGES)
+
+    assert picked == 'https://media.giphy.com/media/abc/giphy-downsized-small.mp4'
+
+
+def test_pick_nothing_fits():
+    images = {'original': IMAGES['original'].copy()}
+    images['original']['mp4_size'] = str(100 * MB)
+
+    assert pick_rendition(images) is None
+
+
+def test_resolver_caches_by_id(tmpdir):
+    """ Verify each Giphy ID is only looked up once, across resolver instances
+    """
+    path = str(tmpdir.join("giphy.db"))
+    session = FakeSession(IMAGES)
+
+    resolver = GiphyResolver("key", path, session=session)
+    first = resolver.resolve("http://giphy.com/gifs/funny-abc")
+    second = resolver.resolve("https://media.giphy.com/media/abc/giphy.gif")
+    resolver.close()
+
+    resolver = GiphyResolver("key", path, session=session)
+    third = resolver.resolve("https://i.giphy.com/abc.gif")
+    resolver.close()
+
+    assert first == second == third
+    assert session.calls == [("https://api.giphy.com/v1/gifs/abc", {'api_key': 'key'})]
+
+
+def test_giphy_meme_uses_resolver(tmpdir):
+    """ Verify GiphyMeme posts the resolved rendition, falling back to a guess
+    """
+    meme = GiphyMeme("http://giphy.com/gifs/funny-lol-gif-abc", "test source")
+
+    GiphyMeme.set_resolver(GiphyResolver("key", str(tmpdir.join("giphy.db")),
+                                         session=FakeSession(IMAGES)))
+    try:
+        _, resolved = meme.format_for_twitter()
+    finally:
+        GiphyMeme.resolver.close()
+        GiphyMeme.set_resolver(None)
+
+    _, guessed = meme.format_for_twitter()
+
+    assert resolved == 'https://media.giphy.com/media/abc/giphy-downsized-small.mp4'
+    assert guessed == "https://media.giphy.com/media/abc/giphy.gif"
+
+
+def test_nothing_fits_is_not_guessed(tmpdir):
+    """ Verify a GIF with no postable rendition is refused, from the cache too,
+        rather than falling back to the oversized original
+    """
+    images = {'original': IMAGES['original'].copy()}
+    images['original']['mp4_size'] = str(100 * MB)
+    session = FakeSession(images)
+    meme = GiphyMeme("http://giphy.com/gifs/funny-lol-gif-abc", "test source")
+
+    GiphyMeme.set_resolver(GiphyResolver("key", str(tmpdir.join("giphy.db")), session=session))
+    try:
+        for _ in range(2):
+            with pytest.raises(MediaTooLargeError):
+                meme.format_for_twitter()
+    finally:
+        GiphyMeme.resolver.close()
+        GiphyMeme.set_resolver(None)
+
+    assert len(session.calls) == 1
@@ -0,0 +1,141 @@
+import os
+from io import BytesIO
+from concurrent.futures import Future
+
+import pytest
+
+from chirplib import media
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _image_bytes(size, fmt, noisy=False):
+    if noisy:
+        img = Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+    else:
+        img = Image.new('RGB', size, (255, 0, 0))
+    buf = BytesIO()
+    img.save(buf, fmt)
+    return buf.getvalue()
+
+
+class FakeResponse(object):
+    def __init__(self, content, content_type='image/png'):
+        self.content = content
+        self.headers = {'Content-Type': content_type}
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession(object):
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = 0
+
+    def get(self, link, timeout=None):
+        self.calls += 1
+        return self.responses[link]
+
+
+def test_small_image_untouched(tmpdir):
+    """ Verify media already inside the limits is cached as-is
+    """
+    data = _image_bytes((100, 100), 'PNG')
+
+    path = media.fit_media(data, str(tmpdir.join("small")))
+
+    assert path.endswith(".png")
+    with open(path, 'rb') as cached:
+        assert cached.read() == data
+
+
+def test_oversized_image_recompressed(tmpdir, monkeypatch):
+    """ Verify an image over the byte and dimension limits gets shrunk to fit
+    """
+    monkeypatch.setattr(media, 'MAX_IMAGE_BYTES', 200 * 1024)
+    monkeypatch.setattr(media, 'MAX_IMAGE_DIMENSION', 400)
+    data = _image_bytes((800, 600), 'PNG', noisy=True)
+
+    path = media.fit_media(data, str(tmpdir.join("big")))
+
+    assert path.endswith(".jpg")
+    assert os.path.getsize(path) <= media.MAX_IMAGE_BYTES
+    assert max(Image.open(path).size) <= media.MAX_IMAGE_DIMENSION
+
+
+def test_gif_trimmed(tmpdir, monkeypatch):
+    """ Verify an animated GIF over the frame limit is cut down
+    """
+    monkeypatch.setattr(media, 'MAX_GIF_FRAMES', 3)
+    frames = [Image.new('RGB', (50, 50), (i * 40, 0, 0)) for i in range(6)]
+    buf = BytesIO()
+    frames[0].save(buf, 'GIF', save_all=True, append_images=frames[1:])
+
+    path = media.fit_media(buf.getvalue(), str(tmpdir.join("anim")))
+
+    assert path.endswith(".gif")
+    assert Image.open(path).n_frames == 3
+
+
+def test_unfittable_image_rejected(tmpdir, monkeypatch):
+    """ Verify media that can't fit raises instead of being uploaded
+    """
+    monkeypatch.setattr(media, 'MAX_IMAGE_BYTES', 10)
+    data = _image_bytes((400, 400), 'PNG', noisy=True)
+
+    with pytest.raises(media.MediaTooLargeError):
+        media.fit_media(data, str(tmpdir.join("huge")))
+
+
+def test_preprocessor_caches_by_content(tmpdir):
+    """ Verify identical content behind different links is only processed once
+    """
+    data = _image_bytes((100, 100), 'PNG')
+    session = FakeSession({
+        'http://i.imgur.com/a.png': FakeResponse(data),
+        'http://i.imgur.com/b.png': FakeResponse(data),
+        'http://youtu.be/abc': FakeResponse(b'<html>', content_type='text/html'),
+    })
+
+    preprocessor = media.MediaPreprocessor(str(tmpdir.join("cache")), max_workers=1,
+                                           session=session)
+    try:
+        first = preprocessor.prepare('http://i.imgur.com/a.png')
+        second, page, nothing = preprocessor.prepare_many(
+            ['http://i.imgur.com/b.png', 'http://youtu.be/abc', None])
+    finally:
+        preprocessor.close()
+
+    assert first == second
+    assert os.path.exists(first)
+    assert page == 'http://youtu.be/abc'
+    assert nothing is None
+    assert len(os.listdir(str(tmpdir.join("cache")))) == 1
+
+
+class FailingPool(object):
+    """ Pool whose work always fails with the given exception
+    """
+    def __init__(self, exc):
+        self.exc = exc
+
+    def submit(self, *args):
+        future = Future()
+        future.set_exception(self.exc)
+        return future
+
+    def shutdown(self):
+        pass
+
+
+def test_unexpected_errors_leave_link_unchanged(tmpdir):
+    """ Verify any other failure in the pool leaves the link to Twitter
+    """
+    link = 'http://i.imgur.com/bomb.png'
+    session = FakeSession({link: FakeResponse(_image_bytes((10, 10), 'PNG'))})
+
+    preprocessor = media.MediaPreprocessor(str(tmpdir.join("cache")), session=session)
+    preprocessor._pool = FailingPool(Image.DecompressionBombError("too many pixels"))
+
+    assert preprocessor.prepare(link) == link
@@ -0,0 +1,75 @@
+import os
+import time
+
+from chirplib import profiling
+from chirplib.budget import RunBudget
+
+
+def _busy_work():
+    return [str(i) * 10 for i in range(20000)]
+
+
+def test_full_profile(tmpdir):
+    """ Verify a full profile writes the cProfile dump and collapsed stacks
+    """
+    with profiling.Profiler(str(tmpdir), trace_memory=True,
+                            memory_focus=(_busy_work, )) as profiler:
+        data = _busy_work()
+
+    files = os.listdir(profiler.output_dir)
+
+    assert os.path.dirname(profiler.output_dir) == str(tmpdir)
+    assert sorted(files) == ['memory.txt', 'profile.prof', 'profile.txt', 'stacks.folded']
+    assert "_busy_work" in open(os.path.join(profiler.output_dir, 'profile.txt')).read()
+
+    memory = open(os.path.join(profiler.output_dir, 'memory.txt')).read()
+    assert "_busy_work" in memory
+    assert __file__ in memory
+    assert data
+
+
+def _stage_work():
+    time.sleep(0.05)
+    return _busy_work()
+
+
+def test_stage_threads_profiled(tmpdir):
+    """ Verify work the run budget moves onto stage threads shows up in both
+        the cProfile dump and the sampled stacks
+    """
+    with profiling.Profiler(str(tmpdir)) as profiler:
+        RunBudget(240).run('reddit', _stage_work)
+
+    assert "_stage_work" in open(os.path.join(profiler.output_dir, 'profile.txt')).read()
+
+    stacks = open(os.path.join(profiler.output_dir, 'stacks.folded')).read()
+    assert "chirp-reddit;" in stacks
+    assert "test_profiling.py:_stage_work" in stacks
+
+
+def test_sample_profile(tmpdir):
+    """ Verify sample mode skips cProfile and only writes stacks
+    """
+    with profiling.Profiler(str(tmpdir), mode=profiling.SAMPLE) as profiler:
+        _busy_work()
+
+    assert os.listdir(profiler.output_dir) == ['stacks.folded']
+
+
+def test_collapsed_stack_format():
+    """ Verify collapsed stacks run from the root frame to the sampled frame
+    """
+    def inner():
+        import sys
+        return profiling.StackSampler._collapse(sys._getframe())
+
+    stack = inner()
+
+    assert stack.endswith("test_profiling.py:test_collapsed_stack_format;test_profiling.py:inner")
+    assert " " not in stack.split(';')[-1]
+
+
+def test_should_sample():
+    assert not profiling.should_sample(0, rand=lambda: 0.0)
+    assert profiling.should_sample(5, rand=lambda: 0.04)
+    assert not profiling.should_sample(5, rand=lambda: 0.05)
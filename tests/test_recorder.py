@@ -0,0 +1,134 @@
+import os
+import time
+
+from chirplib.recorder import WriteBehindStore
+from chirplib.storage import MemoryStore, SQLiteStore
+
+
+class FailingStore(MemoryStore):
+    """ Store that refuses writes, standing in for a database outage
+    """
+    def add_many(self, memes):
+        raise IOError("database is down")
+
+
+def test_reads_through_unflushed_memes(tmpdir):
+    """ Verify a meme is visible to lookups before it has been flushed
+    """
+    backend = MemoryStore()
+    store = WriteBehindStore(backend, str(tmpdir.join("journal")), flush_interval=60)
+
+    store.add("test link", "test source")
+
+    assert store.contains("test link")
+    assert store.contains_many(["test link", "other link"]) == {"test link"}
+    assert not backend.contains("test link")
+
+    store.close()
+
+    assert backend.contains("test link")
+
+
+def test_batch_size_triggers_flush(tmpdir):
+    """ Verify a full batch gets written without waiting for close
+    """
+    backend = MemoryStore()
+    store = WriteBehindStore(backend, str(tmpdir.join("journal")),
+                             batch_size=2, flush_interval=60)
+
+    store.add_many([("link one", "test source"), ("link two", "test source")])
+
+    # Only the flush thread, woken by the full batch, can write these
+    deadline = time.time() + 5
+    while store.pending and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert backend.contains_many(["link one", "link two"]) == {"link one", "link two"}
+    assert not store.pending
+    with open(store.journal_path) as journal:
+        assert journal.read() == ""
+
+    store.close()
+
+
+def test_journal_replayed_after_outage(tmpdir):
+    """ Verify memes journaled during a database outage are written on next start
+    """
+    journal = str(tmpdir.join("journal"))
+
+    store = WriteBehindStore(FailingStore(), journal, flush_interval=60)
+    store.add("test link", "test source")
+    store.close()
+
+    with open(store.journal_path) as left_over:
+        assert "test link" in left_over.read()
+
+    path = str(tmpdir.join("memes.db"))
+    store = WriteBehindStore(SQLiteStore(path), journal, flush_interval=60)
+    assert store.contains("test link")
+    store.close()
+
+    with SQLiteStore(path) as backend:
+        assert backend.contains("test link")
+
+
+def test_replay_skips_flushed_memes(tmpdir):
+    """ Verify replaying a journal that was already flushed doesn't duplicate rows
+    """
+    journal = tmpdir.join("journal")
+    journal.write('["test link", "test source"]\n["torn wri')
+
+    path = str(tmpdir.join("memes.db"))
+    with SQLiteStore(path) as backend:
+        backend.add("test link", "test source")
+
+    store = WriteBehindStore(SQLiteStore(path), str(journal), flush_interval=60)
+    store.close()
+
+    with SQLiteStore(path) as backend:
+        rows = backend._execute("SELECT COUNT(*) FROM memes")
+
+    assert rows[0][0] == 1
+
+
+def test_appends_after_torn_line_replayed(tmpdir):
+    """ Verify memes journaled after a torn line survive the next replay
+    """
+    journal = tmpdir.join("journal")
+    journal.write('["link a", "test source"]\n["torn wri')
+
+    store = WriteBehindStore(FailingStore(), str(journal), flush_interval=60)
+    store.add("link b", "test source")
+    store.add("link c", "test source")
+    store.close()
+
+    store = WriteBehindStore(MemoryStore(), str(journal), flush_interval=60)
+
+    assert list(store.pending) == ["link a", "link b", "link c"]
+
+    store.close()
+
+
+def test_live_journals_not_taken_over(tmpdir):
+    """ Verify processes sharing a journal path only take over journals whose
+        process is gone
+    """
+    journal = str(tmpdir.join("journal"))
+
+    harvest = WriteBehindStore(FailingStore(), journal, flush_interval=60)
+    harvest.add("harvested link", "test source")
+
+    post = WriteBehindStore(MemoryStore(), journal, flush_interval=60)
+    post.add("posted link", "test source")
+    post.close()
+
+    assert not post.pending
+    assert os.path.exists(harvest.journal_path)
+
+    harvest.close()
+
+    backend = MemoryStore()
+    WriteBehindStore(backend, journal, flush_interval=60).close()
+
+    assert backend.contains("harvested link")
+    assert tmpdir.listdir() == []
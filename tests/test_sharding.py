@@ -0,0 +1,134 @@
+import pytest
+
+from chirplib.sharding import HashRing, ShardCoordinator
+from chirplib.storage import MemoryStore, SQLiteStore
+
+SUBREDDITS = ["sub{0}".format(i) for i in range(200)]
+
+
+@pytest.fixture
+def store(tmpdir):
+    new_store = SQLiteStore(str(tmpdir.join("memes.db")))
+    yield new_store
+    new_store.close()
+
+
+def test_hash_ring_moves_few_keys():
+    """ Verify adding a node only moves keys onto the new node
+    """
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+
+    moved = [key for key in SUBREDDITS if before.node_for(key) != after.node_for(key)]
+
+    assert all(after.node_for(key) == "d" for key in moved)
+    assert 0 < len(moved) < len(SUBREDDITS) / 2
+
+
+def test_workers_split_shards(store):
+    """ Verify two workers end up with disjoint shards covering every subreddit
+    """
+    first = ShardCoordinator(store, worker_id="first", shards=16)
+    second = ShardCoordinator(store, worker_id="second", shards=16)
+
+    # first takes everything until it notices second, then hands shards over
+    assert len(first.rebalance()) == 16
+    second.rebalance()
+    first.rebalance()
+    second.rebalance()
+
+    assert first.held
+    assert second.held
+    assert not first.held & second.held
+    assert first.held | second.held == set(range(16))
+
+    first_subs = set(first.subreddits_for(SUBREDDITS))
+    second_subs = set(second.subreddits_for(SUBREDDITS))
+    assert not first_subs & second_subs
+    assert first_subs | second_subs == set(SUBREDDITS)
+
+
+def test_held_shard_not_stolen(store):
+    """ Verify a worker can't claim a shard another worker holds a live lease on
+    """
+    first = ShardCoordinator(store, worker_id="first", shards=4)
+    first.rebalance()
+
+    second = ShardCoordinator(store, worker_id="second", shards=4)
+    second.rebalance()
+
+    assert not second.held
+    assert len(first.held) == 4
+
+
+def test_leaving_worker_hands_over(store):
+    """ Verify shards return to the remaining worker once one leaves
+    """
+    first = ShardCoordinator(store, worker_id="first", shards=8)
+    second = ShardCoordinator(store, worker_id="second", shards=8)
+    for coordinator in (first, second, first, second):
+        coordinator.rebalance()
+
+    second.leave()
+    first.rebalance()
+
+    assert first.held == set(range(8))
+
+
+def test_expired_lease_reclaimed(store):
+    """ Verify a crashed worker's shards are picked up once its leases expire
+    """
+    crashed = ShardCoordinator(store, worker_id="crashed", shards=4)
+    crashed.rebalance()
+
+    # Wind the crashed worker's heartbeat and leases back past the TTL
+    crashed._execute("UPDATE chirp_workers SET heartbeat = heartbeat - 1000")
+    crashed._execute("UPDATE shard_leases SET expires = expires - 1000")
+
+    survivor = ShardCoordinator(store, worker_id="survivor", shards=4)
+
+    assert survivor.rebalance() == set(range(4))
+
+
+def test_one_shot_workers_converge(store):
+    """ Verify one-shot workers, started afresh every cron tick, cover every
+        shard between them once each has run twice
+    """
+    for worker_id in ("host-a", "host-b", "host-a", "host-b"):
+        coordinator = ShardCoordinator(store, worker_id=worker_id, shards=16)
+        coordinator.rebalance()
+        coordinator.con.close()
+
+    held = {worker_id: ShardCoordinator(store, worker_id=worker_id, shards=16)._owned()
+            for worker_id in ("host-a", "host-b")}
+
+    assert held["host-a"]
+    assert held["host-b"]
+    assert not held["host-a"] & held["host-b"]
+    assert held["host-a"] | held["host-b"] == set(range(16))
+
+
+def test_one_shot_worker_renews_leases(store):
+    """ Verify the next run under the default id keeps its predecessor's shards
+    """
+    first = ShardCoordinator(store, shards=8)
+    first.rebalance()
+    first.con.close()
+
+    assert ShardCoordinator(store, shards=8).rebalance() == set(range(8))
+
+
+def test_live_hosts(store):
+    """ Verify each live worker's host is recorded with its heartbeat
+    """
+    local = ShardCoordinator(store, worker_id="local", shards=4)
+    remote = ShardCoordinator(store, worker_id="remote", shards=4)
+    remote.host = "elsewhere"
+    remote.rebalance()
+
+    assert local.live_hosts() == sorted(["elsewhere", local.host])
+
+
+def test_memory_store_rejected():
+    with pytest.raises(ValueError):
+        ShardCoordinator(MemoryStore())
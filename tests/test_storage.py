@@ -0,0 +1,372 @@
+import os
+import time
+from datetime import date, datetime as dt
+from configparser import ConfigParser
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from chirplib.storage import MemoryStore, MySQLStore, SQLiteStore, get_store
+
+
+def _mysql_store():
+    """ MySQL is only exercised when a test database is configured
+    """
+    database = os.environ.get('CHIRP_TEST_MYSQL_DB')
+    if not database:
+        pytest.skip("CHIRP_TEST_MYSQL_DB not set")
+
+    store = MySQLStore(database,
+                       os.environ.get('CHIRP_TEST_MYSQL_USER', 'root'),
+                       os.environ.get('CHIRP_TEST_MYSQL_PASSWORD', ''),
+                       host=os.environ.get('CHIRP_TEST_MYSQL_HOST', 'localhost'))
+    store._execute("DELETE FROM memes")
+    return store
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'mysql'])
+def store(request, tmpdir):
+    if request.param == 'memory':
+        new_store = MemoryStore()
+    elif request.param == 'sqlite':
+        new_store = SQLiteStore(str(tmpdir.join("memes.db")))
+    else:
+        new_store = _mysql_store()
+
+    yield new_store
+    new_store.close()
+
+
+def test_contains_and_add(store):
+    """ Conformance: single item lookups and inserts
+    """
+    assert not store.contains("http://i.imgur.com/abc.jpg")
+
+    store.add("http://i.imgur.com/abc.jpg", "dankmemes")
+
+    assert store.contains("http://i.imgur.com/abc.jpg")
+    assert not store.contains("http://i.imgur.com/def.jpg")
+
+
+def test_contains_many_and_add_many(store):
+    """ Conformance: batched lookups and inserts
+    """
+    store.add_many([("link one", "dankmemes"), ("link two", "fishpost")])
+    store.add_many([])
+
+    found = store.contains_many(["link one", "link two", "link three"])
+
+    assert found == {"link one", "link two"}
+    assert store.contains_many([]) == set()
+
+
+def test_quotes_are_not_sql(store):
+    """ Conformance: links are bound as parameters, never spliced into queries
+    """
+    link = "http://example.com/it's'); DROP TABLE memes; --"
+
+    store.add(link, "dankmemes")
+
+    assert store.contains(link)
+    assert not store.contains("http://example.com/it")
+
+
+def test_contains_many_spans_chunks(store):
+    """ Conformance: lookups larger than one IN (...) chunk
+    """
+    links = ["link {0}".format(i) for i in range(1200)]
+    store.add_many((link, "dankmemes") for link in links[::2])
+
+    assert store.contains_many(links) == set(links[::2])
+
+
+def _add_old(store, links, when=dt(2020, 1, 15)):
+    with patch('chirplib.storage.dt') as fake_dt:
+        fake_dt.now.return_value = when
+        store.add_many((link, "dankmemes") for link in links)
+
+
+def test_prune_and_compact(store):
+    """ Conformance: memes added before the cutoff are pruned, newer ones kept
+    """
+    _add_old(store, ["old one", "old two"])
+    store.add("new one", "dankmemes")
+
+    assert store.prune(dt(2020, 3, 1)) == 2
+    store.compact()
+
+    assert store.contains_many(["old one", "old two", "new one"]) == {"new one"}
+    assert store.prune(dt(2020, 3, 1)) == 0
+
+
+def test_sqlite_prune_archives(tmpdir):
+    """ Verify archived memes move to memes_archive rather than disappearing
+    """
+    with SQLiteStore(str(tmpdir.join("memes.db"))) as store:
+        _add_old(store, ["old one"])
+        store.add("new one", "dankmemes")
+
+        assert store.prune(dt(2020, 3, 1), archive=True) == 1
+        store.compact()
+
+        assert not store.contains("old one")
+        assert store._execute("SELECT links FROM memes_archive") == [("old one", )]
+
+
+def test_sqlite_prune_after_interrupted_archive(tmpdir):
+    """ Verify memes already archived by a prune that died before deleting them
+        are still pruned
+    """
+    with SQLiteStore(str(tmpdir.join("memes.db"))) as store:
+        _add_old(store, ["old one"])
+        store.prune(dt(2000, 1, 1), archive=True)
+        store._execute("INSERT INTO memes_archive SELECT * FROM memes")
+
+        assert store.prune(dt(2020, 3, 1), archive=True) == 1
+        assert not store.contains("old one")
+        assert store._execute("SELECT links FROM memes_archive") == [("old one", )]
+
+
+def test_sqlite_store_persists(tmpdir):
+    """ Verify the SQLite store survives reopening the database file
+    """
+    path = str(tmpdir.join("memes.db"))
+
+    with SQLiteStore(path) as store:
+        store.add("test link", "test source")
+
+    with SQLiteStore(path) as store:
+        assert store.contains("test link")
+
+
+def test_get_store():
+    """ Verify the backend is picked from the [storage] section
+    """
+    config = ConfigParser()
+    config.read_dict({'storage': {'backend': 'memory'}})
+
+    assert isinstance(get_store(config), MemoryStore)
+
+    config['storage']['backend'] = 'postgres'
+    with pytest.raises(ValueError) as excstr:
+        get_store(config)
+
+    assert "Storage backend not recognized" in str(excstr.value)
+
+
+@patch.object(MySQLStore, '_connect')
+def test_get_store_mysql_timeouts(_connect):
+    """ Verify MySQL's connect and read timeouts come from the [mysql] section
+    """
+    config = ConfigParser()
+    config.read_dict({'storage': {'backend': 'mysql'},
+                      'mysql': {'database': 'chirp', 'username': 'chirp', 'password': '',
+                                'read_timeout': '5'}})
+
+    store = get_store(config)
+    assert (store.connect_timeout, store.read_timeout) == (10, 5)
+
+
+def test_batching_beats_per_item(store):
+    """ Throughput: batched adds and lookups should outpace one query per meme
+    """
+    if isinstance(store, MemoryStore):
+        pytest.skip("Nothing to batch in memory")
+
+    count = 500
+    links = ["http://i.imgur.com/{0}.jpg".format(i) for i in range(count * 2)]
+    batched, single = links[:count], links[count:]
+
+    begin = time.perf_counter()
+    store.add_many((link, "dankmemes") for link in batched)
+    batched_add = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    for link in single:
+        store.add(link, "dankmemes")
+    single_add = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    found = store.contains_many(links)
+    batched_lookup = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    assert all(store.contains(link) for link in links)
+    single_lookup = time.perf_counter() - begin
+
+    assert found == set(links)
+    assert batched_add < single_add
+    assert batched_lookup < single_lookup
+
+
+class FakeOperationalError(Exception):
+    pass
+
+
+FAKE_MYSQLDB = SimpleNamespace(Error=Exception, OperationalError=FakeOperationalError)
+
+
+class FlakyMySQLStore(MySQLStore):
+    """ Hands out connections whose first query fails with error
+    """
+    def __init__(self, error):
+        self.error = error
+        self.connections = list()
+        super().__init__('chirp', 'chirp', '')
+
+    def _connect(self):
+        con = MagicMock()
+        con.cursor.return_value.description = None
+        if not self.connections:
+            con.cursor.return_value.execute.side_effect = FakeOperationalError(*self.error)
+        self.connections.append(con)
+        return con
+
+
+@patch.dict('sys.modules', MySQLdb=FAKE_MYSQLDB)
+def test_mysql_reconnects_on_lost_connection():
+    """ Verify a query on a dropped connection is retried on a fresh one
+    """
+    store = FlakyMySQLStore((2006, "MySQL server has gone away"))
+    store._execute("DELETE FROM memes")
+
+    first, second = store.connections
+    assert first.close.called
+    assert store.con is second
+    second.cursor.return_value.execute.assert_called_once_with("DELETE FROM memes", ())
+
+
+@patch.dict('sys.modules', MySQLdb=FAKE_MYSQLDB)
+def test_mysql_other_errors_not_retried():
+    """ Verify errors other than a lost connection aren't blindly re-run
+    """
+    store = FlakyMySQLStore((1205, "Lock wait timeout exceeded"))
+    with pytest.raises(FakeOperationalError):
+        store._execute("DELETE FROM memes")
+
+    assert len(store.connections) == 1
+
+
+class FakeDate(date):
+    @classmethod
+    def today(cls):
+        return cls(2026, 10, 19)
+
+
+class FakeMySQLStore(MySQLStore):
+    """ Records the SQL MySQLStore would run, answering its queries from canned
+        rows, so the DDL can be checked without a server
+    """
+    def __init__(self, partitions=(), keys=(('memes', 0, 'PRIMARY', 1, 'id'), ),
+                 oldest=dt(2026, 8, 3)):
+        self.database = 'chirp'
+        self.names = list(partitions)
+        self.keys = keys
+        self.oldest = oldest
+        self.queries = list()
+
+    def _execute(self, query, params=(), many=False):
+        query = ' '.join(query.split())
+        self.queries.append(query)
+
+        if 'information_schema.PARTITIONS' in query:
+            return [(name, ) for name in self.names + ['pmax']]
+        elif query.startswith("SELECT MIN"):
+            return [(self.oldest, )]
+        elif query.startswith("SHOW KEYS"):
+            return list(self.keys)
+        elif query.startswith("SELECT COUNT"):
+            return [(7, )]
+        return None
+
+    def ddl(self):
+        return [query for query in self.queries if query.startswith(("ALTER", "CREATE"))]
+
+
+def _month_partitions(*months):
+    return ", ".join("PARTITION p{0} VALUES LESS THAN (TO_DAYS('{1}'))".format(name, end)
+                     for name, end in months)
+
+
+@patch('chirplib.storage.date', FakeDate)
+def test_mysql_partition_from_scratch():
+    """ Verify an unpartitioned table is partitioned monthly from its oldest
+        meme to three months ahead, after adding datecreated to the primary key
+    """
+    store = FakeMySQLStore()
+    store.partition()
+
+    months = _month_partitions(("202608", "2026-09-01"), ("202609", "2026-10-01"),
+                               ("202610", "2026-11-01"), ("202611", "2026-12-01"),
+                               ("202612", "2027-01-01"), ("202701", "2027-02-01"))
+    assert store.ddl() == [
+        "ALTER TABLE memes DROP PRIMARY KEY, ADD PRIMARY KEY (id, datecreated)",
+        "ALTER TABLE memes PARTITION BY RANGE (TO_DAYS(datecreated)) "
+        "({0}, PARTITION pmax VALUES LESS THAN MAXVALUE)".format(months),
+    ]
+
+
+@patch('chirplib.storage.date', FakeDate)
+def test_mysql_partition_refuses_unique_keys():
+    """ Verify unique keys without datecreated are refused, not rewritten
+    """
+    store = FakeMySQLStore(keys=[('memes', 0, 'PRIMARY', 1, 'id'),
+                                 ('memes', 0, 'links_unique', 1, 'links'),
+                                 ('memes', 1, 'memes_sources', 1, 'sources')])
+
+    with pytest.raises(ValueError) as excstr:
+        store.partition()
+
+    assert "links_unique" in str(excstr.value)
+    assert "memes_sources" not in str(excstr.value)
+    assert store.ddl() == []
+
+
+@patch('chirplib.storage.date', FakeDate)
+def test_mysql_partition_rolls_forward():
+    """ Verify missing months are split off pmax, and nothing happens when
+        the partitions already reach far enough ahead
+    """
+    store = FakeMySQLStore(partitions=["p202609", "p202610", "p202611"])
+    store.partition()
+
+    months = _month_partitions(("202612", "2027-01-01"), ("202701", "2027-02-01"))
+    assert store.ddl() == [
+        "ALTER TABLE memes REORGANIZE PARTITION pmax INTO "
+        "({0}, PARTITION pmax VALUES LESS THAN MAXVALUE)".format(months),
+    ]
+
+    store = FakeMySQLStore(partitions=["p202612", "p202701"])
+    store.partition()
+
+    assert store.ddl() == []
+
+
+@patch('chirplib.storage.date', FakeDate)
+def test_mysql_prune_archives_whole_months():
+    """ Verify only months wholly before the cutoff are exchanged into archive
+        tables and dropped
+    """
+    store = FakeMySQLStore(partitions=["p202604", "p202605", "p202606", "p202701"])
+
+    assert store.prune(dt(2026, 6, 15), archive=True) == 14
+    assert store.ddl() == [
+        "CREATE TABLE memes_archive_202604 LIKE memes",
+        "ALTER TABLE memes_archive_202604 REMOVE PARTITIONING",
+        "ALTER TABLE memes EXCHANGE PARTITION p202604 WITH TABLE memes_archive_202604",
+        "ALTER TABLE memes DROP PARTITION p202604",
+        "CREATE TABLE memes_archive_202605 LIKE memes",
+        "ALTER TABLE memes_archive_202605 REMOVE PARTITIONING",
+        "ALTER TABLE memes EXCHANGE PARTITION p202605 WITH TABLE memes_archive_202605",
+        "ALTER TABLE memes DROP PARTITION p202605",
+    ]
+
+
+@patch('chirplib.storage.date', FakeDate)
+def test_mysql_prune_drops():
+    store = FakeMySQLStore(partitions=["p202604", "p202701"])
+
+    assert store.prune(dt(2026, 6, 15)) == 7
+
+    assert store.ddl() == ["ALTER TABLE memes DROP PARTITION p202604"]
@@ -0,0 +1,79 @@
+import threading
+from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from chirplib.transport import DEFAULT_TIMEOUT, Transport
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        body = self.headers.get('Accept-Encoding', '').encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield "http://127.0.0.1:{0}/".format(httpd.server_port)
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_connections_reused(server):
+    """ Verify repeated requests to one host share a kept-alive connection
+    """
+    transport = Transport()
+
+    for _ in range(3):
+        resp = transport.session.get(server)
+        assert 'gzip' in resp.text
+
+    assert transport.stats() == {'127.0.0.1': (1, 3)}
+    assert "3 requests over 1 connections (2 reused)" in transport.format_stats()
+
+    transport.close()
+
+
+def test_default_timeout_applied():
+    """ Verify requests without a timeout pick up the transport default
+    """
+    transport = Transport(timeout=(1, 2))
+    seen = dict()
+
+    def fake_send(request, **kwargs):
+        seen.update(kwargs)
+        raise RuntimeError("stop before touching the network")
+
+    transport.session.send = fake_send
+
+    with pytest.raises(RuntimeError):
+        transport.session.get("http://example.com/")
+
+    assert seen['timeout'] == (1, 2)
+
+
+def test_from_config():
+    """ Verify missing options fall back to the defaults
+    """
+    config = ConfigParser()
+    config.read_dict({'transport': {'read_timeout': '10'}})
+
+    transport = Transport.from_config(config)
+
+    assert transport.timeout == (DEFAULT_TIMEOUT[0], 10.0)
+    assert transport.adapter._pool_maxsize == 4